@@ -0,0 +1,51 @@
+"""
+Editor page rendering benchmark
+Compares per-request CPU time of a cold /editor render (config, JWT, template) with a cached one
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+# Run against the api-server modules without touching a real MinIO or save queue
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("SAVE_QUEUE_BACKEND", "memory")
+
+import main  # noqa: E402
+
+
+def measure(requests: int, cold: bool) -> float:
+    """CPU seconds per build_editor_page call"""
+    s3_object = main.object_index.put("uploads/report.docx", 123456, "0123456789abcdef0123456789abcdef")
+    document_key = main.generate_document_key(s3_object.key, s3_object.etag)
+    document_url = f"http://host.docker.internal:{main.settings.webhook_port}/download/report.docx"
+    main.editor_pages.clear()
+    main.build_editor_page("report.docx", s3_object.key, document_key, document_url, "7", "alice", False)
+
+    start = time.process_time()
+    for _ in range(requests):
+        if cold:
+            main.editor_pages.clear()
+        main.build_editor_page("report.docx", s3_object.key, document_key, document_url, "7", "alice", False)
+    return (time.process_time() - start) / requests
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark /editor page rendering")
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    # Per-render INFO logging would dominate the cold numbers
+    main.logging.getLogger().setLevel(main.logging.WARNING)
+
+    cold = measure(args.requests, cold=True)
+    warm = measure(args.requests, cold=False)
+    print(f"cold render: {cold * 1e6:8.1f} us CPU/request")
+    print(f"warm render: {warm * 1e6:8.1f} us CPU/request")
+    print(f"speedup:     {cold / warm:8.1f}x")
+
+
+if __name__ == "__main__":
+    main_cli()
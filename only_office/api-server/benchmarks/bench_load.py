@@ -0,0 +1,300 @@
+"""
+End-to-end load benchmark
+Runs the API server against a local S3 stand-in and a fake Document Server, drives concurrent workloads
+and reports throughput, latency percentiles and peak RSS
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+import uvicorn
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+sys.path.insert(0, str(BENCH_DIR))
+
+from document_keys import generate_document_key  # noqa: E402
+import fake_document_server  # noqa: E402
+
+WORKLOADS = ("editor", "download-cold", "download-warm", "upload", "upload-batch", "autosave")
+
+
+def document_name(i: int) -> str:
+    return f"bench-{i:05d}.docx"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def read_proc_status(pid: int, field: str) -> Optional[float]:
+    """A /proc/<pid>/status memory field in MiB (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+async def run_workload(
+    name: str,
+    count: int,
+    concurrency: int,
+    request: Callable[[int], Awaitable[httpx.Response]],
+    app_pid: int,
+) -> Dict[str, Any]:
+    """Issue `count` requests from `concurrency` workers and summarise their latencies"""
+    latencies: List[float] = []
+    errors = 0
+    next_index = iter(range(count))
+
+    async def worker():
+        nonlocal errors
+        for i in next_index:
+            start = time.perf_counter()
+            try:
+                response = await request(i)
+                ok = response.status_code < 400
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "workload": name,
+        "requests": count,
+        "concurrency": concurrency,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(count / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        "peak_rss_mb": read_proc_status(app_pid, "VmHWM"),
+    }
+
+
+async def wait_until_ready(client: httpx.AsyncClient, url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"API server exited with code {process.returncode}")
+        try:
+            if (await client.get(url)).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("API server did not start in time")
+
+
+async def wait_for_saves(client: httpx.AsyncClient, app_url: str, timeout: float = 120.0) -> Dict[str, Any]:
+    """Poll /save-queue until every queued save has finished"""
+    deadline = time.monotonic() + timeout
+    while True:
+        stats = (await client.get(f"{app_url}/save-queue")).json()
+        if stats["depth"] == 0 or time.monotonic() > deadline:
+            return stats
+        await asyncio.sleep(0.05)
+
+
+async def benchmark(args) -> List[Dict[str, Any]]:
+    app_port, ds_port = free_port(), free_port()
+    app_url = f"http://127.0.0.1:{app_port}"
+    ds_url = f"http://127.0.0.1:{ds_port}"
+    work_dir = Path(tempfile.mkdtemp(prefix="onlyoffice-bench-"))
+
+    # The fake Document Server runs in this process; the API server gets its own so RSS is its alone
+    ds_server = uvicorn.Server(uvicorn.Config(fake_document_server.app, host="127.0.0.1", port=ds_port, log_level="warning"))
+    ds_task = asyncio.create_task(ds_server.serve())
+
+    env = dict(
+        os.environ,
+        TEMP_DIR=str(work_dir / "temp_files"),
+        SAVE_QUEUE_BACKEND="memory",
+        WEBHOOK_PORT=str(app_port),
+        METRICS_ENABLED=str(args.metrics).lower(),
+    )
+    command = [
+        sys.executable, str(BENCH_DIR / "run_app.py"),
+        "--port", str(app_port),
+        "--s3", args.s3,
+        "--s3-latency-ms", str(args.s3_latency_ms),
+        "--s3-bandwidth-mbps", str(args.s3_bandwidth_mbps),
+        "--documents", str(args.documents),
+        "--document-size", str(args.document_size),
+        "--log-level", args.app_log_level,
+    ]
+    log_file = open(work_dir / "api-server.log", "wb")
+    process = subprocess.Popen(command, cwd=work_dir, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    results = []
+    try:
+        async with httpx.AsyncClient(limits=limits, timeout=120.0) as client:
+            await wait_until_ready(client, f"{app_url}/", process)
+            hot = max(1, min(args.hot_documents, args.documents))
+            selected = args.workloads.split(",")
+
+            if "editor" in selected:
+                results.append(await run_workload(
+                    "editor", args.requests, args.concurrency,
+                    lambda i: client.get(f"{app_url}/editor/{document_name(i % hot)}", params={"user_id": str(i % args.editor_users)}),
+                    process.pid,
+                ))
+
+            if "download-cold" in selected:
+                # Every request is for a document this server has not cached yet
+                cold_start = hot
+                count = min(args.requests, args.documents - cold_start)
+                results.append(await run_workload(
+                    "download-cold", count, args.concurrency,
+                    lambda i: client.get(f"{app_url}/download/{document_name(cold_start + i)}"),
+                    process.pid,
+                ))
+
+            if "download-warm" in selected:
+                for i in range(hot):
+                    await client.get(f"{app_url}/download/{document_name(i)}")
+                results.append(await run_workload(
+                    "download-warm", args.requests, args.concurrency,
+                    lambda i: client.get(f"{app_url}/download/{document_name(i % hot)}"),
+                    process.pid,
+                ))
+
+            if "upload" in selected:
+                body = fake_document_server.document_body(args.upload_size)
+                results.append(await run_workload(
+                    f"upload-{args.upload_size // 1024}k", args.upload_requests, args.concurrency,
+                    lambda i: client.post(f"{app_url}/upload", files={"file": (f"upload-{i}.docx", body)}),
+                    process.pid,
+                ))
+
+            if "upload-batch" in selected:
+                # The same number of files as the upload workload, batch_files per request
+                body = fake_document_server.document_body(args.upload_size)
+                batches = max(1, args.upload_requests // args.batch_files)
+                result = await run_workload(
+                    f"upload-batch-{args.batch_files}", batches, max(1, min(args.concurrency, batches)),
+                    lambda i: client.post(
+                        f"{app_url}/upload/batch",
+                        params={"format": "json"},
+                        files=[("files", (f"batch-{i}-{j}.docx", body)) for j in range(args.batch_files)],
+                    ),
+                    process.pid,
+                )
+                result["files_per_second"] = round(batches * args.batch_files / result["seconds"], 1)
+                results.append(result)
+
+            if "autosave" in selected:
+                # Each document gets a burst of force saves followed by the final save on close
+                documents = min(args.autosave_documents, args.documents)
+                per_document = args.autosave_events + 1
+                keys = [generate_document_key(f"uploads/{document_name(i)}", "benchmark") for i in range(documents)]
+
+                def callback(i: int) -> Awaitable[httpx.Response]:
+                    document, event = i % documents, i // documents
+                    status = 2 if event == per_document - 1 else 6
+                    url = f"{ds_url}/cache/{document_name(document)}?size={args.document_size}&event={event}"
+                    return fake_document_server.fire_callback(client, app_url, keys[document], status, url)
+
+                result = await run_workload("autosave-callbacks", documents * per_document, args.concurrency, callback, process.pid)
+                drain_start = time.perf_counter()
+                stats = await wait_for_saves(client, app_url)
+                result["save_drain_seconds"] = round(time.perf_counter() - drain_start, 3)
+                result["saves_completed"] = stats["completed"]
+                result["saves_coalesced"] = stats["coalesced"]
+                result["peak_rss_mb"] = read_proc_status(process.pid, "VmHWM")
+                results.append(result)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        log_file.close()
+        ds_server.should_exit = True
+        await ds_task
+    return results
+
+
+def print_table(results: List[Dict[str, Any]]) -> None:
+    columns = ("workload", "requests", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "peak_rss_mb")
+    print(f"{columns[0]:<20}" + "".join(f"{c:>16}" for c in columns[1:]))
+    for result in results:
+        cells = [f"{result['workload']:<20}"]
+        for c in columns[1:]:
+            value = result.get(c)
+            cells.append(f"{value:>16.1f}" if isinstance(value, float) else f"{str(value):>16}")
+        print("".join(cells))
+    for result in results:
+        if "files_per_second" in result:
+            print(f"\n{result['workload']}: {result['files_per_second']} files/s")
+        if "save_drain_seconds" in result:
+            print(
+                f"\nautosave: {result['saves_completed']} saves completed, {result['saves_coalesced']} coalesced, "
+                f"queue drained {result['save_drain_seconds']}s after the last callback"
+            )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="End-to-end load benchmark for the ONLYOFFICE API server")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help=f"Comma-separated subset of {', '.join(WORKLOADS)}")
+    parser.add_argument("--s3", choices=["fake", "minio"], default="fake", help="minio uses the MINIO_* settings (e.g. a local MinIO)")
+    parser.add_argument("--s3-latency-ms", type=float, default=5.0, help="Simulated per-call S3 latency (fake S3 only)")
+    parser.add_argument("--s3-bandwidth-mbps", type=float, default=0.0, help="Simulated S3 bandwidth, 0 = unlimited (fake S3 only)")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--documents", type=int, default=200, help="Documents seeded into S3")
+    parser.add_argument("--document-size", type=int, default=256 * 1024)
+    parser.add_argument("--hot-documents", type=int, default=10, help="Documents used by the editor and warm download workloads")
+    parser.add_argument("--editor-users", type=int, default=5)
+    parser.add_argument("--upload-size", type=int, default=1024 * 1024)
+    parser.add_argument("--upload-requests", type=int, default=100)
+    parser.add_argument("--batch-files", type=int, default=25, help="Files per /upload/batch request")
+    parser.add_argument("--autosave-documents", type=int, default=20)
+    parser.add_argument("--autosave-events", type=int, default=10, help="Force saves per document before the final save")
+    parser.add_argument("--metrics", action=argparse.BooleanOptionalAction, default=True, help="Run with /metrics instrumentation")
+    parser.add_argument("--app-log-level", default="warning")
+    parser.add_argument("--json", help="Also write the results to this file")
+    return parser.parse_args()
+
+
+def main_cli():
+    args = parse_args()
+    results = asyncio.run(benchmark(args))
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
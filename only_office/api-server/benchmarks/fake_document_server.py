@@ -0,0 +1,41 @@
+"""
+ONLYOFFICE Document Server stand-in for benchmarks
+Serves "edited" documents for save callbacks and fires /webhook/callback events at the API server
+"""
+
+from typing import Dict
+
+import httpx
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+
+_bodies: Dict[int, bytes] = {}
+
+
+def document_body(size: int) -> bytes:
+    """Deterministic document bytes of the given size, generated once per size"""
+    if size not in _bodies:
+        pattern = b"ONLYOFFICE benchmark document body. "
+        _bodies[size] = (pattern * (size // len(pattern) + 1))[:size]
+    return _bodies[size]
+
+
+async def edited_document(request: Request) -> Response:
+    size = int(request.query_params.get("size", 64 * 1024))
+    return Response(
+        document_body(size),
+        media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    )
+
+
+app = Starlette(routes=[Route("/cache/{name}", edited_document)])
+
+
+async def fire_callback(client: httpx.AsyncClient, app_url: str, document_key: str, status: int, document_url: str = None) -> httpx.Response:
+    """Send a callback the way the Document Server does (status 2 = closed and ready to save, 6 = force save)"""
+    payload = {"key": document_key, "status": status, "users": ["benchmark"]}
+    if document_url:
+        payload["url"] = document_url
+    return await client.post(f"{app_url}/webhook/callback", json=payload)
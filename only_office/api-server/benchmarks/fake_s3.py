@@ -0,0 +1,146 @@
+"""
+In-process S3 stand-in for benchmarks
+Implements the subset of the MinIO client API the server uses, with optional simulated latency and bandwidth
+"""
+
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterator, Optional
+
+from minio.error import S3Error
+
+
+class FakeObject:
+    """Stored object; doubles as the stat_object and list_objects result"""
+
+    def __init__(self, object_name: str, data: bytes, content_type: str = "application/octet-stream"):
+        self.object_name = object_name
+        self.data = data
+        self.size = len(data)
+        self.etag = hashlib.md5(data).hexdigest()
+        self.last_modified = datetime.now(timezone.utc)
+        self.content_type = content_type
+        self.version_id = None
+        self.is_dir = False
+
+
+class FakeResponse:
+    """Streaming body returned by get_object"""
+
+    def __init__(self, data: bytes, headers: Dict[str, str], client: "FakeS3Client"):
+        self.data = data
+        self.headers = headers
+        self._client = client
+
+    def stream(self, amt: int = 64 * 1024) -> Iterator[bytes]:
+        for i in range(0, len(self.data), amt):
+            chunk = self.data[i:i + amt]
+            self._client._transfer_delay(len(chunk))
+            yield chunk
+
+    def read(self) -> bytes:
+        self._client._transfer_delay(len(self.data))
+        return self.data
+
+    def close(self) -> None:
+        pass
+
+    def release_conn(self) -> None:
+        pass
+
+
+class FakeWriteResult:
+    def __init__(self, obj: FakeObject):
+        self.object_name = obj.object_name
+        self.etag = obj.etag
+        self.version_id = None
+        self.last_modified = obj.last_modified
+
+
+class FakeS3Client:
+    """
+    Thread-safe in-memory bucket behind the MinIO client interface.
+
+    latency_seconds is added to every call, like a network round trip;
+    bandwidth_bytes_per_second (0 = unlimited) throttles object bodies.
+    """
+
+    def __init__(self, latency_seconds: float = 0.0, bandwidth_bytes_per_second: float = 0.0):
+        self.latency_seconds = latency_seconds
+        self.bandwidth_bytes_per_second = bandwidth_bytes_per_second
+        self.objects: Dict[str, FakeObject] = {}
+        self.calls: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _call(self, op: str) -> None:
+        with self._lock:
+            self.calls[op] = self.calls.get(op, 0) + 1
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+    def _transfer_delay(self, size: int) -> None:
+        if self.bandwidth_bytes_per_second:
+            time.sleep(size / self.bandwidth_bytes_per_second)
+
+    def _missing(self, object_name: str) -> S3Error:
+        return S3Error(None, "NoSuchKey", "The specified key does not exist.", object_name, "", "")
+
+    def seed(self, object_name: str, data: bytes) -> None:
+        self.objects[object_name] = FakeObject(object_name, data)
+
+    def bucket_exists(self, bucket_name: str) -> bool:
+        self._call("bucket_exists")
+        return True
+
+    def make_bucket(self, bucket_name: str, *args, **kwargs) -> None:
+        self._call("make_bucket")
+
+    def stat_object(self, bucket_name: str, object_name: str, *args, **kwargs) -> FakeObject:
+        self._call("stat_object")
+        obj = self.objects.get(object_name)
+        if obj is None:
+            raise self._missing(object_name)
+        return obj
+
+    def get_object(self, bucket_name: str, object_name: str, *args, **kwargs) -> FakeResponse:
+        self._call("get_object")
+        obj = self.objects.get(object_name)
+        if obj is None:
+            raise self._missing(object_name)
+        return FakeResponse(obj.data, {"ETag": f'"{obj.etag}"', "Content-Length": str(obj.size)}, self)
+
+    def put_object(self, bucket_name: str, object_name: str, data, length: int, content_type: str = "application/octet-stream", part_size: int = 0, **kwargs) -> FakeWriteResult:
+        self._call("put_object")
+        if length >= 0:
+            body = data.read(length)
+        else:
+            parts = []
+            while True:
+                chunk = data.read(part_size or 5 * 1024 * 1024)
+                if not chunk:
+                    break
+                parts.append(chunk)
+            body = b"".join(parts)
+        self._transfer_delay(len(body))
+        obj = FakeObject(object_name, body, content_type)
+        self.objects[object_name] = obj
+        return FakeWriteResult(obj)
+
+    def fput_object(self, bucket_name: str, object_name: str, file_path: str, content_type: str = "application/octet-stream", **kwargs) -> FakeWriteResult:
+        with open(file_path, "rb") as f:
+            return self.put_object(bucket_name, object_name, f, -1, content_type)
+
+    def list_objects(self, bucket_name: str, prefix: Optional[str] = None, recursive: bool = False, start_after: Optional[str] = None, **kwargs) -> Iterator[FakeObject]:
+        self._call("list_objects")
+        for object_name in sorted(self.objects):
+            if prefix and not object_name.startswith(prefix):
+                continue
+            if start_after and object_name <= start_after:
+                continue
+            yield self.objects[object_name]
+
+    def presigned_get_object(self, bucket_name: str, object_name: str, *args, **kwargs) -> str:
+        self._call("presigned_get_object")
+        return f"http://fake-s3.local/{bucket_name}/{object_name}?X-Amz-Signature=benchmark"
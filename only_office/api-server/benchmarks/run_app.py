@@ -0,0 +1,59 @@
+"""
+API server launcher for the load benchmark
+Starts main.app with uvicorn, optionally against the in-process fake S3, and seeds benchmark documents
+"""
+
+import argparse
+import io
+import logging
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+os.environ.setdefault("SAVE_QUEUE_BACKEND", "memory")
+
+import uvicorn  # noqa: E402
+
+import main  # noqa: E402
+from fake_s3 import FakeS3Client  # noqa: E402
+from fake_document_server import document_body  # noqa: E402
+from bench_load import document_name  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the API server for benchmarking")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--s3", choices=["fake", "minio"], default="fake")
+    parser.add_argument("--s3-latency-ms", type=float, default=5.0)
+    parser.add_argument("--s3-bandwidth-mbps", type=float, default=0.0, help="0 = unlimited")
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--document-size", type=int, default=256 * 1024)
+    parser.add_argument("--log-level", default="warning")
+    return parser.parse_args()
+
+
+def run():
+    args = parse_args()
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    if args.s3 == "fake":
+        client = FakeS3Client(args.s3_latency_ms / 1000, args.s3_bandwidth_mbps * 1024 * 1024 / 8)
+        main.minio_client = client
+        main.storage.client = client
+    else:
+        # Local MinIO from the usual MINIO_* settings
+        client = main.minio_client
+        if not client.bucket_exists(main.settings.minio_bucket):
+            client.make_bucket(main.settings.minio_bucket)
+
+    body = document_body(args.document_size)
+    for i in range(args.documents):
+        client.put_object(main.settings.minio_bucket, f"uploads/{document_name(i)}", io.BytesIO(body), len(body))
+
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level=args.log_level, access_log=False)
+
+
+if __name__ == "__main__":
+    run()
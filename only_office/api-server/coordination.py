@@ -0,0 +1,278 @@
+"""
+Cross-instance cache coordination
+Shares filename -> S3 key resolutions, object versions and open editing sessions between API replicas and broadcasts invalidations
+"""
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Called with (S3 key, new version or None when the object was deleted) for changes made by other instances
+ChangeHandler = Callable[[str, Optional["ObjectVersion"]], None]
+
+
+class ObjectVersion(NamedTuple):
+    """An S3 object version as last seen by any instance"""
+    key: str
+    size: int
+    etag: Optional[str]
+    last_modified: Optional[datetime]
+    validated_at: float  # time.time() when an instance last confirmed it against S3
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "key": self.key,
+            "size": self.size,
+            "etag": self.etag,
+            "last_modified": self.last_modified.isoformat() if self.last_modified else None,
+            "validated_at": self.validated_at,
+        })
+
+    @classmethod
+    def from_json(cls, raw) -> "ObjectVersion":
+        data = json.loads(raw)
+        last_modified = datetime.fromisoformat(data["last_modified"]) if data["last_modified"] else None
+        return cls(data["key"], data["size"], data["etag"], last_modified, data["validated_at"])
+
+    @classmethod
+    def now(cls, key: str, size: int, etag: Optional[str], last_modified: Optional[datetime]) -> "ObjectVersion":
+        return cls(key, size or 0, etag, last_modified, time.time())
+
+
+class MemoryBus:
+    """Shared state for MemoryCoordinators; instances on the same bus behave like replicas sharing Redis"""
+
+    def __init__(self):
+        self.paths: Dict[str, str] = {}
+        self.versions: Dict[str, ObjectVersion] = {}
+        # S3 key -> (document key of the open editing session, time.time() at which it lapses)
+        self.sessions: Dict[str, Tuple[str, float]] = {}
+        self.subscribers: List["MemoryCoordinator"] = []
+
+
+class MemoryCoordinator:
+    """In-process coordination backend, for a single instance or for tests"""
+
+    def __init__(self, bus: Optional[MemoryBus] = None):
+        self.instance_id = uuid.uuid4().hex
+        self._bus = bus or MemoryBus()
+        self._handler: Optional[ChangeHandler] = None
+        self.invalidations_received = 0
+
+    async def start(self, handler: ChangeHandler) -> None:
+        self._handler = handler
+        self._bus.subscribers.append(self)
+
+    async def get_path(self, filename: str) -> Optional[str]:
+        return self._bus.paths.get(filename)
+
+    async def set_path(self, filename: str, s3_key: str) -> None:
+        self._bus.paths[filename] = s3_key
+
+    async def get_version(self, s3_key: str) -> Optional[ObjectVersion]:
+        return self._bus.versions.get(s3_key)
+
+    async def put_version(self, version: ObjectVersion) -> None:
+        self._bus.versions[version.key] = version
+
+    async def get_session(self, s3_key: str) -> Optional[str]:
+        session = self._bus.sessions.get(s3_key)
+        if session is None:
+            return None
+        if session[1] < time.time():
+            del self._bus.sessions[s3_key]
+            return None
+        return session[0]
+
+    async def open_session(self, s3_key: str, document_key: str, ttl_seconds: float) -> None:
+        self._bus.sessions[s3_key] = (document_key, time.time() + ttl_seconds)
+
+    async def close_session(self, s3_key: str, document_key: str) -> None:
+        session = self._bus.sessions.get(s3_key)
+        if session and session[0] == document_key:
+            del self._bus.sessions[s3_key]
+
+    async def publish(self, s3_key: str, version: Optional[ObjectVersion]) -> None:
+        """Record a change to an object and tell every other instance about it"""
+        if version is None:
+            self._bus.versions.pop(s3_key, None)
+            self._drop_paths(s3_key)
+        else:
+            self._bus.versions[s3_key] = version
+        for subscriber in self._bus.subscribers:
+            if subscriber is not self:
+                subscriber._receive(s3_key, version)
+
+    def _drop_paths(self, s3_key: str) -> None:
+        for filename in [f for f, key in self._bus.paths.items() if key == s3_key]:
+            del self._bus.paths[filename]
+
+    def _receive(self, s3_key: str, version: Optional[ObjectVersion]) -> None:
+        self.invalidations_received += 1
+        if self._handler:
+            self._handler(s3_key, version)
+
+    async def close(self) -> None:
+        if self in self._bus.subscribers:
+            self._bus.subscribers.remove(self)
+
+
+# Deletes a session key only while it still holds the given document key
+_CLOSE_SESSION_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+end
+"""
+
+
+class RedisCoordinator:
+    """
+    Coordination through Redis: two hashes hold path resolutions and object
+    versions, an expiring key per document holds its open editing session,
+    and a pub/sub channel carries invalidations.
+
+    Redis errors are logged and treated as a miss, so an unavailable Redis
+    degrades replicas to working independently rather than failing requests.
+    """
+
+    def __init__(self, host: str, port: int, db: int = 0, namespace: str = "onlyoffice"):
+        import redis.asyncio as aioredis
+
+        self.instance_id = uuid.uuid4().hex
+        self._redis = aioredis.Redis(host=host, port=port, db=db)
+        self._paths_key = f"{namespace}:paths"
+        self._versions_key = f"{namespace}:objects"
+        self._session_prefix = f"{namespace}:session:"
+        self._close_session = self._redis.register_script(_CLOSE_SESSION_SCRIPT)
+        self._channel = f"{namespace}:invalidations"
+        self._handler: Optional[ChangeHandler] = None
+        self._task: Optional[asyncio.Task] = None
+        self.invalidations_received = 0
+
+    async def start(self, handler: ChangeHandler) -> None:
+        self._handler = handler
+        self._task = asyncio.create_task(self._listen_forever())
+
+    async def _listen_forever(self) -> None:
+        while True:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self._channel)
+                logger.info(f"Subscribed to cache invalidations on {self._channel}")
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self._receive(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Cache invalidation subscription failed, reconnecting: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    def _receive(self, raw) -> None:
+        try:
+            data = json.loads(raw)
+            if data["instance"] == self.instance_id:
+                return
+            version = ObjectVersion.from_json(data["version"]) if data["version"] else None
+        except Exception as e:
+            logger.error(f"Ignoring malformed cache invalidation: {e}")
+            return
+        self.invalidations_received += 1
+        if self._handler:
+            self._handler(data["key"], version)
+
+    async def get_path(self, filename: str) -> Optional[str]:
+        try:
+            raw = await self._redis.hget(self._paths_key, filename)
+            return raw.decode() if raw else None
+        except Exception as e:
+            logger.error(f"Redis path lookup failed: {e}")
+            return None
+
+    async def set_path(self, filename: str, s3_key: str) -> None:
+        try:
+            await self._redis.hset(self._paths_key, filename, s3_key)
+        except Exception as e:
+            logger.error(f"Redis path update failed: {e}")
+
+    async def get_version(self, s3_key: str) -> Optional[ObjectVersion]:
+        try:
+            raw = await self._redis.hget(self._versions_key, s3_key)
+            return ObjectVersion.from_json(raw) if raw else None
+        except Exception as e:
+            logger.error(f"Redis version lookup failed: {e}")
+            return None
+
+    async def put_version(self, version: ObjectVersion) -> None:
+        try:
+            await self._redis.hset(self._versions_key, version.key, version.to_json())
+        except Exception as e:
+            logger.error(f"Redis version update failed: {e}")
+
+    async def get_session(self, s3_key: str) -> Optional[str]:
+        try:
+            raw = await self._redis.get(self._session_prefix + s3_key)
+            return raw.decode() if raw else None
+        except Exception as e:
+            logger.error(f"Redis session lookup failed: {e}")
+            return None
+
+    async def open_session(self, s3_key: str, document_key: str, ttl_seconds: float) -> None:
+        try:
+            await self._redis.set(self._session_prefix + s3_key, document_key, px=int(ttl_seconds * 1000))
+        except Exception as e:
+            logger.error(f"Redis session update failed: {e}")
+
+    async def close_session(self, s3_key: str, document_key: str) -> None:
+        try:
+            await self._close_session(keys=[self._session_prefix + s3_key], args=[document_key])
+        except Exception as e:
+            logger.error(f"Redis session close failed: {e}")
+
+    async def publish(self, s3_key: str, version: Optional[ObjectVersion]) -> None:
+        """Record a change to an object and tell every other instance about it"""
+        message = json.dumps({
+            "instance": self.instance_id,
+            "key": s3_key,
+            "version": version.to_json() if version else None,
+        })
+        try:
+            async with self._redis.pipeline(transaction=True) as pipe:
+                if version is None:
+                    pipe.hdel(self._versions_key, s3_key)
+                    pipe.hdel(self._paths_key, s3_key.split("/")[-1])
+                else:
+                    pipe.hset(self._versions_key, s3_key, version.to_json())
+                pipe.publish(self._channel, message)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Publishing cache invalidation for {s3_key} failed: {e}")
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._redis.aclose()
+
+
+def create_coordinator(backend: str, redis_host: str, redis_port: int, redis_db: int):
+    """Build the coordination backend named in settings; None when replicas run independently"""
+    if backend == "redis":
+        return RedisCoordinator(redis_host, redis_port, redis_db)
+    if backend == "memory":
+        return MemoryCoordinator()
+    if backend == "none":
+        return None
+    raise ValueError(f"Unknown coordination backend: {backend}")
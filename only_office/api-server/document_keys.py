@@ -0,0 +1,129 @@
+"""
+ONLYOFFICE document keys
+Version-aware keys that change whenever the S3 object changes, and tracking of keys held by open editing sessions
+"""
+
+import base64
+import hashlib
+import logging
+import re
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ONLYOFFICE accepts keys of up to 128 characters from [0-9a-zA-Z.=_-]
+DOCUMENT_KEY_MAX_LENGTH = 128
+VERSION_LENGTH = 20
+KEY_PREFIX = "v2."
+HASHED_KEY_PREFIX = "v2h."
+
+
+def document_version(etag: Optional[str]) -> str:
+    """Compact key-safe token for an object version"""
+    version = re.sub(r"[^0-9A-Za-z]", "", etag or "")[:VERSION_LENGTH]
+    return version or "0"
+
+
+def path_digest(s3_path: str) -> str:
+    return hashlib.md5(s3_path.encode()).hexdigest()
+
+
+def generate_document_key(s3_path: str, etag: Optional[str]) -> str:
+    """
+    Document key for one version of an S3 object.
+
+    Format: v2.{version}.{urlsafe base64 S3 path}, where version comes from
+    the ETag. Paths too long for the key limit use v2h.{version}.{md5 of path};
+    the caller must record digest -> path so parse_document_key can resolve it.
+    """
+    version = document_version(etag)
+    encoded_s3_path = base64.urlsafe_b64encode(s3_path.encode()).decode().rstrip("=")
+    document_key = f"{KEY_PREFIX}{version}.{encoded_s3_path}"
+    if len(document_key) <= DOCUMENT_KEY_MAX_LENGTH:
+        return document_key
+    return f"{HASHED_KEY_PREFIX}{version}.{path_digest(s3_path)}"
+
+
+def hashed_key_digest(document_key: str) -> Optional[str]:
+    """The path digest of a v2h key, or None for keys that carry their path"""
+    if document_key.startswith(HASHED_KEY_PREFIX) and document_key.count(".") >= 2:
+        return document_key.split(".", 2)[2]
+    return None
+
+
+def parse_document_key(
+    document_key: str,
+    resolve_digest: Optional[Callable[[str], Optional[str]]] = None,
+) -> Tuple[str, Optional[str]]:
+    """
+    Extract (filename, original S3 path) from an ONLYOFFICE document key.
+
+    Understands the current v2 formats and the older doc_{hash}_{base64_s3_path}_{filename}
+    keys. The S3 path is None when it cannot be recovered from the key.
+    """
+    if document_key.startswith(KEY_PREFIX) and document_key.count(".") >= 2:
+        encoded_s3_path = document_key.split(".", 2)[2]
+        try:
+            padding = "=" * (-len(encoded_s3_path) % 4)
+            s3_path = base64.urlsafe_b64decode(encoded_s3_path + padding).decode()
+            return s3_path.split("/")[-1], s3_path
+        except Exception:
+            logger.warning(f"Could not decode S3 path from document key {document_key}")
+            return "", None
+
+    if document_key.startswith(HASHED_KEY_PREFIX) and document_key.count(".") >= 2:
+        s3_path = resolve_digest(document_key.split(".", 2)[2]) if resolve_digest else None
+        if s3_path:
+            return s3_path.split("/")[-1], s3_path
+        logger.warning(f"Could not resolve S3 path for document key {document_key}")
+        return "", None
+
+    if document_key.startswith("doc_") and document_key.count("_") >= 3:
+        parts = document_key.split("_", 3)  # Split into max 4 parts: ['doc', hash, s3_path, filename]
+        try:
+            return parts[3], base64.b64decode(parts[2].encode()).decode()
+        except Exception:
+            return parts[3], None
+
+    # Fallback for old format
+    filename = document_key.split("_", 2)[-1] if "_" in document_key else f"document_{document_key}.docx"
+    return filename, None
+
+
+class EditingSessions:
+    """
+    Document keys held by open editing sessions, per S3 path.
+
+    Everyone joining a session must get the key it was opened with, even
+    after a force save has changed the object's ETag. A new version-aware key
+    is only issued once ONLYOFFICE reports the session closed, or after the
+    session has gone quiet for ttl_seconds.
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        # S3 path -> (document key, time.time() at which the session lapses)
+        self._sessions: Dict[str, Tuple[str, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def key_for(self, s3_path: str) -> Optional[str]:
+        session = self._sessions.get(s3_path)
+        if session is None:
+            return None
+        if session[1] < time.time():
+            del self._sessions[s3_path]
+            return None
+        return session[0]
+
+    def open(self, s3_path: str, document_key: str) -> None:
+        """Start or extend the session for a document"""
+        self._sessions[s3_path] = (document_key, time.time() + self.ttl_seconds)
+
+    def close(self, s3_path: str, document_key: str) -> None:
+        """End the session, unless a newer session with another key has taken its place"""
+        session = self._sessions.get(s3_path)
+        if session and session[0] == document_key:
+            del self._sessions[s3_path]
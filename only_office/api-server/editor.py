@@ -0,0 +1,268 @@
+"""
+ONLYOFFICE page rendering
+Precompiled HTML templates and a cache of rendered editor pages keyed by document version and user
+"""
+
+import logging
+from collections import OrderedDict
+from string import Template
+from typing import Dict, Hashable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+ROOT_PAGE_TEMPLATE = Template("""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>ONLYOFFICE MinIO API Server</title>
+        <style>
+            body { font-family: Arial, sans-serif; margin: 40px; background-color: #f5f5f5; }
+            .container { background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
+            h1 { color: #333; }
+            .status { padding: 10px; margin: 10px 0; border-radius: 4px; }
+            .success { background-color: #d4edda; color: #155724; border: 1px solid #c3e6cb; }
+            .info { background-color: #cce7ff; color: #004085; border: 1px solid #99d6ff; }
+            a { color: #007bff; text-decoration: none; }
+            a:hover { text-decoration: underline; }
+            .endpoint { background-color: #f8f9fa; padding: 10px; margin: 5px 0; border-radius: 4px; }
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <h1>🏢 ONLYOFFICE MinIO API Server</h1>
+            
+            <div class="status success">
+                ✅ Server is running successfully!
+            </div>
+            
+            <h2>📋 Configuration</h2>
+            <div class="info">
+                <strong>ONLYOFFICE Server:</strong> ${onlyoffice_server_url}<br>
+                <strong>MinIO Endpoint:</strong> ${minio_endpoint}<br>
+                <strong>Storage Bucket:</strong> ${minio_bucket}<br>
+                <strong>Environment:</strong> ${environment}
+            </div>
+            
+            <h2>🔗 API Endpoints</h2>
+            <div class="endpoint"><strong>GET</strong> <a href="/docs">/docs</a> - Interactive API Documentation</div>
+            <div class="endpoint"><strong>GET</strong> <a href="/health">/health</a> - Health Check</div>
+            <div class="endpoint"><strong>POST</strong> /webhook/callback - ONLYOFFICE Document Callback</div>
+            <div class="endpoint"><strong>GET</strong> <a href="/save-queue">/save-queue</a> - Callback Save Queue Status</div>
+            <div class="endpoint"><strong>POST</strong> /upload - Upload File to S3</div>
+            <div class="endpoint"><strong>GET</strong> /download/{filename} - Download File from Temp Storage</div>
+            <div class="endpoint"><strong>GET</strong> /documents - List Documents in S3</div>
+            <div class="endpoint"><strong>GET</strong> /temp-files - List Temporary Files</div>
+            <div class="endpoint"><strong>POST</strong> /cleanup-temp-files - Clean Up Old Temp Files</div>
+            <div class="endpoint"><strong>DELETE</strong> /temp-files/{filename} - Delete Specific Temp File</div>
+            <div class="endpoint"><strong>GET</strong> /editor/{filename} - Document Editor</div>
+            <div class="endpoint"><strong>GET</strong> /editor/{filename}?user_id={id}&username={name}&readonly={true/false} - Document Editor with User & Permissions</div>
+            
+            <h2>🧪 Test Links</h2>
+            <p><a href="/health">Health Check</a></p>
+            <p><a href="/documents">List Documents in S3</a></p>
+            <p><a href="/temp-files">List Temporary Files</a></p>
+            <p><a href="/docs">API Documentation</a></p>
+            
+            <h2>👥 Real-time Collaboration Testing</h2>
+            <p>To test collaboration with different permission levels, open the same document with different users:</p>
+            <div class="endpoint">
+                <strong>Editor 1 (Full Access):</strong> <code>/editor/document.docx?user_id=1&username=Alice</code><br>
+                <strong>Editor 2 (Full Access):</strong> <code>/editor/document.docx?user_id=2&username=Bob</code><br>
+                <strong>Viewer (Read-Only):</strong> <code>/editor/document.docx?user_id=3&username=Charlie&readonly=true</code>
+            </div>
+            <p><small>Replace "document.docx" with your actual filename.</small></p>
+            <h3>📋 Permission Levels:</h3>
+            <div class="endpoint">
+                <strong>✏️ Edit Mode:</strong> Can edit, comment, review, fill forms<br>
+                <strong>📖 Read-Only:</strong> Can only view and download (no editing, commenting, or reviewing)
+            </div>
+            
+            <h2>📱 ONLYOFFICE Integration</h2>
+            <p>Webhook URL for ONLYOFFICE: <code>http://localhost:${webhook_port}/webhook/callback</code></p>
+            <p>Access ONLYOFFICE: <a href="${onlyoffice_server_url}" target="_blank">${onlyoffice_server_url}</a></p>
+        </div>
+    </body>
+    </html>
+    """)
+
+EDITOR_PAGE_TEMPLATE = Template("""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="utf-8">
+            <title>Edit ${filename} - ONLYOFFICE</title>
+            <style>
+                html, body {
+                    margin: 0;
+                    padding: 0;
+                    height: 100%;
+                    font-family: Arial, sans-serif;
+                    background-color: #f5f5f5;
+                }
+                .container {
+                    display: flex;
+                    flex-direction: column;
+                    height: 100vh;
+                    padding: 10px;
+                    box-sizing: border-box;
+                }
+                .header {
+                    background: white;
+                    padding: 15px;
+                    border-radius: 8px;
+                    box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+                    margin-bottom: 10px;
+                    flex-shrink: 0;
+                }
+                .editor-container {
+                    background: white;
+                    border-radius: 8px;
+                    box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+                    overflow: hidden;
+                    flex: 1;
+                    display: flex;
+                    flex-direction: column;
+                }
+                #editor {
+                    width: 100%;
+                    height: 100%;
+                    min-height: 500px;
+                    border: none;
+                }
+                .info {
+                    display: flex;
+                    justify-content: space-between;
+                    align-items: center;
+                }
+                .back-link {
+                    background: #007bff;
+                    color: white;
+                    padding: 8px 16px;
+                    text-decoration: none;
+                    border-radius: 4px;
+                }
+                .back-link:hover {
+                    background: #0056b3;
+                }
+            </style>
+        </head>
+        <body>
+            <div class="container">
+                <div class="header">
+                    <div class="info">
+                        <div>
+                            <h2>📄 ${filename}</h2>
+                            <p><strong>Document Type:</strong> ${document_type_title}</p>
+                            <p><strong>Current User:</strong> ${username} (ID: ${user_id}) ${mode_label}</p>
+                            <p><strong>Document Key:</strong> <code>${document_key}</code></p>
+                            <p><strong>Original S3 Path:</strong> <code>${original_s3_path}</code></p>
+                            <p><small>Changes will be saved back to the original location</small></p>
+                            <p><small>💡 <strong>Real-time Collaboration:</strong> Open this same URL in another window with different users to test collaboration!</small></p>
+                            ${readonly_banner}
+                        </div>
+                        <a href="http://${host_ip}:${webhook_port}/" class="back-link">← Back to API</a>
+                    </div>
+                </div>
+                
+                <div class="editor-container">
+                    <div id="editor"></div>
+                </div>
+            </div>
+
+            <script src="${onlyoffice_server_url}/web-apps/apps/api/documents/api.js"></script>
+            <script>
+                window.onload = function() {
+                    console.log('Initializing ONLYOFFICE editor...');
+                    console.log('Document URL:', '${document_url}');
+                    console.log('Callback URL:', '${callback_url}');
+                    console.log('JWT Enabled:', ${jwt_enabled});
+                    
+                    // ONLYOFFICE configuration with JWT token
+                    var config = ${config_json};
+                    
+                    // Add event handlers for collaboration
+                    config.events = {
+                        "onReady": function() {
+                            console.log("Document editor ready for user: ${username} (${mode} mode)");
+                        },
+                        "onError": function(event) {
+                            console.error("Editor error:", event);
+                            alert("Error loading document: " + JSON.stringify(event));
+                        },
+                        "onDocumentStateChange": function(event) {
+                            console.log("Document state changed:", event);
+                        },
+                        "onInfo": function(event) {
+                            console.log("Editor info:", event);
+                        },
+                        "onWarning": function(event) {
+                            console.warn("Editor warning:", event);
+                        },
+                        "onRequestUsers": function(event) {
+                            console.log("Users requested:", event);
+                        },
+                        "onRequestSendNotify": function(event) {
+                            console.log("Send notify requested:", event);
+                        },
+                        "onCollaborativeChanges": function() {
+                            console.log("Collaborative changes detected");
+                        }
+                    };
+                    
+                    console.log('ONLYOFFICE config:', config);
+                    
+                    var docEditor = new DocsAPI.DocEditor("editor", config);
+                };
+            </script>
+        </body>
+        </html>
+        """)
+
+READONLY_BANNER = '<p style="background-color: #fff3cd; color: #856404; padding: 10px; border-radius: 4px; margin-top: 10px;"><strong>📖 READ-ONLY MODE:</strong> You can view this document but cannot make changes.</p>'
+
+
+class RenderedPageCache:
+    """
+    LRU cache of rendered editor pages.
+
+    Keys start with the document's S3 path, so every page for a document can
+    be dropped at once when it is saved or replaced.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._pages: "OrderedDict[Hashable, str]" = OrderedDict()
+        self._keys_by_path: Dict[str, Set[Hashable]] = {}
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def get(self, key: Hashable) -> Optional[str]:
+        page = self._pages.get(key)
+        if page is not None:
+            self._pages.move_to_end(key)
+        return page
+
+    def put(self, key: Hashable, s3_path: str, page: str) -> None:
+        self._pages[key] = page
+        self._pages.move_to_end(key)
+        self._keys_by_path.setdefault(s3_path, set()).add(key)
+        while len(self._pages) > self.max_entries:
+            old_key, _ = self._pages.popitem(last=False)
+            self._discard_key(old_key)
+
+    def invalidate(self, s3_path: str) -> None:
+        """Drop every cached page for a document"""
+        for key in self._keys_by_path.pop(s3_path, ()):
+            self._pages.pop(key, None)
+
+    def clear(self) -> None:
+        self._pages.clear()
+        self._keys_by_path.clear()
+
+    def _discard_key(self, key: Hashable) -> None:
+        keys = self._keys_by_path.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_path[key[0]]
@@ -5,31 +5,50 @@ Now includes temporary file management for better editing control
 """
 
 import os
-import io
 import uuid
 import asyncio
 import logging
+import time
 import jwt
 import json
 import tempfile
 import shutil
 import base64
-import hashlib
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
+import mimetypes
+import zipfile
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from urllib.parse import quote
+from typing import Optional, Dict, Any, List, Tuple, Set, BinaryIO, Callable, ContextManager
 from pathlib import Path
 
 import uvicorn
 import httpx
 import aiofiles
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request, BackgroundTasks
-from fastapi.responses import JSONResponse, StreamingResponse, HTMLResponse, FileResponse
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request, Query
+from fastapi.responses import Response, JSONResponse, StreamingResponse, HTMLResponse, FileResponse, RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings
 from minio import Minio
 from minio.error import S3Error
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from storage import AsyncStorage, PresignedUrlCache, build_http_client
+from metrics import (
+    MetricsMiddleware, EDITOR_RENDER_SECONDS, SAVED_DOCUMENT_BYTES, SAVE_QUEUE_DEPTH, SERVED_DOCUMENT_BYTES,
+    TEMP_CACHE_BYTES, TEMP_CACHE_FILES, TEMP_CACHE_MEMORY_BYTES, TEMP_CACHE_REQUESTS
+)
+from object_index import ObjectIndex, IndexRefresher, IndexedObject, candidate_keys
+from peers import HashRing, PeerFetcher, PEER_REQUEST_HEADER, PEER_SIGNATURE_HEADER, S3_KEY_HEADER
+from save_queue import SaveQueue, create_save_store
+from coordination import ObjectVersion, create_coordinator
+from document_keys import EditingSessions, generate_document_key, hashed_key_digest, parse_document_key
+from editor import ROOT_PAGE_TEMPLATE, EDITOR_PAGE_TEMPLATE, READONLY_BANNER, RenderedPageCache
+from temp_cache import TempFileCache, CacheEntry, CacheMaintainer, SingleFlight, discard_partial
+from warmup import WarmupManager
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -47,6 +66,7 @@ class Settings(BaseSettings):
     minio_secret_key: str = "CHANGE THIS"
     minio_bucket: str = "pg-itbs-dev"
     minio_secure: bool = True
+    minio_region: Optional[str] = None  # Set to avoid a bucket-location lookup when presigning URLs
     
     # Server Configuration
     webhook_port: int = 3000
@@ -58,6 +78,86 @@ class Settings(BaseSettings):
     # Temporary file management
     temp_dir: str = "temp_files"
     temp_file_ttl_hours: int = 24  # Files older than this will be cleaned up
+    temp_cache_freshness_seconds: int = 30  # Cached files are revalidated against S3 at most this often
+    temp_cache_max_bytes: int = 10 * 1024 ** 3  # Least recently used files are evicted above this size
+    temp_cache_max_entries: int = 10000
+    temp_cache_pin_hours: int = 12  # How long an open editing session protects its file from eviction
+    temp_cache_maintenance_interval_seconds: int = 300  # Background cleanup interval (0 disables it)
+    temp_cache_maintenance_batch_size: int = 200  # Files handled between yields to the event loop
+    temp_cache_memory_max_bytes: int = 256 * 1024 ** 2  # RAM tier for hot small files (0 disables it)
+    temp_cache_memory_max_object_bytes: int = 1024 ** 2  # Larger files are always served from disk
+    temp_cache_memory_promote_hits: int = 2  # Accesses before a file is copied into RAM
+    temp_cache_disk_chunk_size_kb: int = 1024  # Read size when streaming files from disk
+    warmup_concurrency: int = 4  # Default parallel fetches of a cache warm-up job
+    
+    # S3 access layer (connection pool, concurrency limits, per-operation timeouts)
+    s3_pool_size: int = 32  # Max pooled connections to the S3 endpoint
+    s3_max_concurrent_requests: int = 16  # Concurrent metadata calls (stat, bucket checks, list)
+    s3_max_concurrent_transfers: int = 8  # Concurrent object downloads/uploads
+    s3_connect_timeout_seconds: float = 5.0
+    s3_read_timeout_seconds: float = 60.0  # Also bounds transfers: a stalled read fails, a slow large one does not
+    s3_retries: int = 3
+    s3_metadata_timeout_seconds: float = 10.0
+    s3_list_timeout_seconds: float = 60.0
+    s3_upload_part_size_mb: int = 16  # Multipart part size (S3 minimum is 5 MB)
+    s3_parallel_part_uploads: int = 3  # Parts of one object uploaded concurrently
+    upload_batch_concurrency: int = 4  # Files of one /upload/batch request uploaded concurrently
+    
+    # Document delivery to ONLYOFFICE
+    # proxy: bytes are served by this server from the temp cache
+    # redirect: /download answers with a 307 to a presigned S3 URL
+    # presigned: the editor config embeds the presigned URL directly (and /download redirects)
+    download_mode: str = "proxy"
+    presigned_url_expiry_seconds: int = 3600
+    presigned_url_refresh_margin_seconds: int = 300  # Re-sign cached URLs this long before they expire
+    presigned_url_cache_size: int = 10000  # Presigned URLs kept for reuse, least recently used dropped first
+    
+    # Document listing
+    documents_page_size: int = 1000  # Default /documents page size when no limit is given
+    documents_cache_ttl_seconds: int = 300  # Listings are served from memory while the last full refresh is this recent
+    documents_cache_refresh_interval_seconds: int = 10  # Rolling background refresh tick (0 disables it)
+    documents_cache_refresh_pages: int = 10  # Minimum S3 LIST pages (1000 keys each) re-listed per tick; raised for large buckets
+    
+    # Callback saves
+    callback_save_tee_to_cache: bool = True  # Keep a local copy of saved documents while streaming them to S3
+    save_queue_backend: str = "sqlite"  # sqlite | redis | memory
+    save_queue_sqlite_path: str = "save_queue.db"
+    save_queue_workers: int = 4
+    save_queue_max_attempts: int = 5
+    save_queue_retry_base_seconds: float = 2.0  # Doubles on each retry
+    save_queue_retry_max_seconds: float = 60.0
+    save_queue_drain_timeout_seconds: float = 30.0  # How long shutdown waits for running saves
+    save_queue_lease_seconds: float = 30.0  # Redis backend: a stopped replica's saves are adopted after this long
+    
+    # Shared HTTP client for ONLYOFFICE downloads and health probes
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry_seconds: float = 30.0
+    http_connect_timeout_seconds: float = 5.0
+    http_read_timeout_seconds: float = 60.0
+    http_http2: bool = False  # Requires the h2 package (httpx[http2])
+    
+    # Editor pages
+    editor_page_cache_size: int = 1024  # Rendered /editor pages kept per document version and user
+    
+    # Redis (see ../../redis)
+    redis_host: str = "localhost"
+    redis_port: int = 6379
+    redis_db: int = 0
+    s3_index_on_startup: bool = True  # Build the filename -> S3 key index from a bucket scan at startup
+    
+    # Replica coordination (the instances behind traefik/fastapi_services.yml)
+    coordination_backend: str = "none"  # none | memory | redis; redis shares path/ETag metadata and invalidations
+    
+    # Peer cache fill: replicas pull documents they do not own from the owning replica before S3
+    peer_urls: str = ""  # Comma-separated base URLs of all replicas, including this one (empty disables it)
+    peer_self_url: str = ""  # This replica's entry in peer_urls, e.g. http://host.docker.internal:8000
+    peer_virtual_nodes: int = 100  # Points per replica on the consistent hash ring
+    peer_fetch_timeout_seconds: float = 30.0
+    peer_shared_secret: str = ""  # Signs requests between replicas; peer fill stays off without it
+    
+    # Monitoring
+    metrics_enabled: bool = True  # Expose Prometheus metrics on /metrics
     
     class Config:
         env_file = "../only_office.env"
@@ -80,18 +180,137 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route request latency histograms
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+
 # Initialize MinIO client
 minio_client = Minio(
     settings.minio_endpoint,
     access_key=settings.minio_access_key,
     secret_key=settings.minio_secret_key,
-    secure=settings.minio_secure
+    secure=settings.minio_secure,
+    region=settings.minio_region,
+    http_client=build_http_client(
+        pool_size=settings.s3_pool_size,
+        connect_timeout=settings.s3_connect_timeout_seconds,
+        read_timeout=settings.s3_read_timeout_seconds,
+        retries=settings.s3_retries
+    )
+)
+
+# All S3 access from request handlers goes through the async storage layer
+storage = AsyncStorage(
+    minio_client,
+    settings.minio_bucket,
+    max_concurrent_requests=settings.s3_max_concurrent_requests,
+    max_concurrent_transfers=settings.s3_max_concurrent_transfers,
+    metadata_timeout=settings.s3_metadata_timeout_seconds,
+    list_timeout=settings.s3_list_timeout_seconds,
+    part_size=settings.s3_upload_part_size_mb * 1024 * 1024,
+    parallel_part_uploads=settings.s3_parallel_part_uploads
+)
+
+# Presigned GET URLs for redirect/presigned download modes
+presigned_urls = PresignedUrlCache(
+    storage,
+    settings.presigned_url_expiry_seconds,
+    settings.presigned_url_refresh_margin_seconds,
+    settings.presigned_url_cache_size
+)
+
+# Filename -> S3 key index and listing cache, kept current on every write
+object_index = ObjectIndex()
+index_refresher = IndexRefresher(
+    object_index,
+    storage,
+    interval_seconds=settings.documents_cache_refresh_interval_seconds,
+    pages_per_tick=settings.documents_cache_refresh_pages,
+    # A sweep must finish within half the TTL: the index stays fresh until the previous sweep's start plus the TTL
+    sweep_seconds=settings.documents_cache_ttl_seconds / 2
 )
 
 # Create temp directory
 TEMP_DIR = Path(settings.temp_dir)
 TEMP_DIR.mkdir(exist_ok=True)
 
+# Source ETag/last-modified of every cached file, for revalidation against S3
+temp_cache = TempFileCache(
+    TEMP_DIR,
+    settings.temp_cache_freshness_seconds,
+    max_bytes=settings.temp_cache_max_bytes,
+    max_entries=settings.temp_cache_max_entries,
+    memory_max_bytes=settings.temp_cache_memory_max_bytes,
+    memory_max_object_bytes=settings.temp_cache_memory_max_object_bytes,
+    memory_promote_hits=settings.temp_cache_memory_promote_hits
+)
+
+TEMP_CACHE_BYTES.set_function(lambda: temp_cache.total_bytes)
+TEMP_CACHE_FILES.set_function(lambda: len(temp_cache))
+TEMP_CACHE_MEMORY_BYTES.set_function(lambda: temp_cache.memory.total_bytes)
+
+# Periodic expiry/eviction of the temp cache
+cache_maintainer = CacheMaintainer(
+    temp_cache,
+    interval_seconds=settings.temp_cache_maintenance_interval_seconds,
+    ttl_seconds=settings.temp_file_ttl_hours * 3600,
+    batch_size=settings.temp_cache_maintenance_batch_size
+)
+
+# Concurrent cache misses for the same file share one S3 fetch
+download_flights = SingleFlight()
+
+# Background prefetch jobs started through /temp-files/warmup
+warmups = WarmupManager(temp_cache, lambda s3_key: download_s3_object_to_temp(s3_key))
+
+# Rendered /editor pages, dropped per document whenever it is saved or re-uploaded
+editor_pages = RenderedPageCache(settings.editor_page_cache_size)
+
+# Document keys of open editing sessions; collaborators keep the session's key across force saves
+editing_sessions = EditingSessions(settings.temp_cache_pin_hours * 3600)
+
+# Shared path resolutions, object versions and invalidations across API replicas (None when disabled)
+coordinator = create_coordinator(
+    settings.coordination_backend,
+    settings.redis_host,
+    settings.redis_port,
+    settings.redis_db,
+)
+
+# Application-wide HTTP client, created on first use so connections stay warm across requests
+http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared pooled HTTP client"""
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.http_max_connections,
+                max_keepalive_connections=settings.http_max_keepalive_connections,
+                keepalive_expiry=settings.http_keepalive_expiry_seconds
+            ),
+            timeout=httpx.Timeout(
+                settings.http_read_timeout_seconds,
+                connect=settings.http_connect_timeout_seconds
+            ),
+            http2=settings.http_http2
+        )
+    return http_client
+
+# Owner-first cache fill between replicas (None when peer_urls is not set)
+peer_fetcher: Optional[PeerFetcher] = None
+if settings.peer_urls and not settings.peer_shared_secret:
+    logger.error("PEER_URLS is set without PEER_SHARED_SECRET; peer cache fill is disabled")
+elif settings.peer_urls:
+    peer_fetcher = PeerFetcher(
+        HashRing([url.strip().rstrip("/") for url in settings.peer_urls.split(",") if url.strip()], settings.peer_virtual_nodes),
+        settings.peer_self_url.rstrip("/"),
+        settings.peer_shared_secret,
+        get_http_client,
+        settings.peer_fetch_timeout_seconds,
+    )
+
 # Pydantic models
 class DocumentCallback(BaseModel):
     """ONLYOFFICE document callback model"""
@@ -122,133 +341,317 @@ class UploadResponse(BaseModel):
     size: int
     bucket: str
 
+class WarmupRequest(BaseModel):
+    """Objects to prefetch into the temp cache; keys are added to what prefix and modified_within_hours select"""
+    prefix: Optional[str] = None
+    keys: Optional[List[str]] = None  # S3 keys or bare filenames
+    modified_within_hours: Optional[float] = Field(None, gt=0)
+    limit: Optional[int] = Field(None, ge=1)
+    concurrency: Optional[int] = Field(None, ge=1, le=64)
+
 # Utility functions
+bucket_ready = False
+
 async def ensure_bucket_exists():
-    """Ensure MinIO bucket exists"""
+    """Ensure MinIO bucket exists; S3 is only asked until the bucket has been confirmed once"""
+    global bucket_ready
+    if bucket_ready:
+        return True
     try:
-        if not minio_client.bucket_exists(settings.minio_bucket):
-            minio_client.make_bucket(settings.minio_bucket)
+        if not await storage.bucket_exists():
+            await storage.make_bucket()
             logger.info(f"Created bucket: {settings.minio_bucket}")
+        bucket_ready = True
         return True
-    except S3Error as e:
+    except (S3Error, asyncio.TimeoutError) as e:
         logger.error(f"Error creating bucket: {e}")
         return False
 
-async def cleanup_old_temp_files():
-    """Clean up temporary files older than TTL"""
+async def refresh_object_index():
+    """Rebuild the filename -> S3 key index from a full bucket listing"""
     try:
-        cutoff_time = datetime.now() - timedelta(hours=settings.temp_file_ttl_hours)
-        for temp_file in TEMP_DIR.glob("*"):
-            if temp_file.is_file():
-                file_mtime = datetime.fromtimestamp(temp_file.stat().st_mtime)
-                if file_mtime < cutoff_time:
-                    temp_file.unlink()
-                    logger.info(f"Cleaned up old temp file: {temp_file.name}")
+        # Stamped before listing: the listing is only as fresh as its first page
+        listed_at = time.monotonic()
+        objects = await storage.list_objects(recursive=True)
+        object_index.load(objects, listed_at)
     except Exception as e:
-        logger.error(f"Error cleaning up temp files: {e}")
+        logger.error(f"Error building object index: {e}")
 
-async def download_s3_file_to_temp(filename: str) -> Optional[Path]:
-    """Download file from S3 to temporary storage and return the local path"""
+async def resolve_s3_object(filename: str) -> Optional[IndexedObject]:
+    """Resolve a filename to its S3 object from the index, probing S3 only on an index miss"""
+    entry = object_index.lookup(filename)
+    if entry:
+        return entry
+    
+    # Another replica may already have resolved it
+    if coordinator:
+        shared_key = await coordinator.get_path(filename)
+        version = await coordinator.get_version(shared_key) if shared_key else None
+        if version:
+            return object_index.put(version.key, version.size, version.etag, version.last_modified)
+    
+    for path in candidate_keys(filename):
+        try:
+            stat = await storage.stat_object(path)
+            logger.info(f"Found file at S3 path: {path}")
+            if coordinator:
+                await coordinator.set_path(filename, path)
+                await coordinator.put_version(ObjectVersion.now(path, stat.size, stat.etag, stat.last_modified))
+            return object_index.put(path, stat.size, stat.etag, stat.last_modified)
+        except S3Error as e:
+            if e.code == "NoSuchKey":
+                continue
+            else:
+                logger.error(f"S3 Error for path {path}: {e}")
+                raise e
+    
+    return None
+
+async def shared_fresh_version(s3_key: str) -> Optional[ObjectVersion]:
+    """Object version another replica confirmed against S3 within the freshness window"""
+    if not coordinator:
+        return None
+    version = await coordinator.get_version(s3_key)
+    if version and time.time() - version.validated_at < settings.temp_cache_freshness_seconds:
+        return version
+    return None
+
+async def confirm_s3_object(s3_object: IndexedObject) -> Optional[IndexedObject]:
+    """Revalidate an index entry older than the freshness window with a HEAD request; None if the object is gone"""
+    if time.monotonic() - s3_object.indexed_at < settings.temp_cache_freshness_seconds:
+        return s3_object
+    version = await shared_fresh_version(s3_object.key)
+    if version is None:
+        try:
+            version = await storage.stat_object(s3_object.key)
+        except S3Error as e:
+            if e.code == "NoSuchKey":
+                object_index.remove(s3_object.key)
+                temp_cache.forget(s3_object.key)
+                await announce_object_change(s3_object.key, None)
+                return None
+            raise
+        if coordinator:
+            await coordinator.put_version(ObjectVersion.now(s3_object.key, version.size, version.etag, version.last_modified))
+    return object_index.put(s3_object.key, version.size, version.etag, version.last_modified)
+
+async def announce_object_change(s3_key: str, entry: Optional[IndexedObject]) -> None:
+    """Tell the other replicas an object was written (entry) or found deleted (None)"""
+    if coordinator:
+        version = ObjectVersion.now(s3_key, entry.size, entry.etag, entry.last_modified) if entry else None
+        await coordinator.publish(s3_key, version)
+
+def apply_remote_change(s3_key: str, version: Optional[ObjectVersion]) -> None:
+    """Bring local caches in line with a change made by another replica"""
+    editor_pages.invalidate(s3_key)
+    presigned_urls.invalidate(s3_key)
+    if version is None:
+        object_index.remove(s3_key)
+    else:
+        object_index.put(s3_key, version.size, version.etag, version.last_modified)
+    
+    entry = temp_cache.get(s3_key)
+    if entry:
+        if version and entry.etag and entry.etag == version.etag:
+            temp_cache.mark_validated(entry)
+        else:
+            # The next access revalidates and refetches the cached copy
+            temp_cache.invalidate(s3_key)
+
+async def cleanup_old_temp_files() -> Optional[Dict[str, Any]]:
+    """Clean up temporary files not accessed within the TTL and enforce the cache budget"""
     try:
-        # Check if file already exists in temp storage
-        temp_file_path = TEMP_DIR / filename
-        if temp_file_path.exists():
-            logger.info(f"File {filename} already exists in temp storage")
-            return temp_file_path
-        
-        # Try different S3 paths where the file might be stored
-        possible_paths = [f"uploads/{filename}", f"{filename}", f"documents/{filename}"]
-        s3_object_path = None
-        
-        for path in possible_paths:
-            try:
-                # Check if object exists at this path
-                minio_client.stat_object(settings.minio_bucket, path)
-                s3_object_path = path
-                logger.info(f"Found file at S3 path: {path}")
-                break
-            except S3Error as e:
-                if e.code == "NoSuchKey":
-                    continue
-                else:
-                    logger.error(f"S3 Error for path {path}: {e}")
-                    raise e
-        
-        if not s3_object_path:
-            logger.error(f"File {filename} not found in S3 bucket {settings.minio_bucket}")
-            return None
-        
-        # Download file from S3 to temp storage
-        logger.info(f"Downloading {filename} from S3 to temp storage...")
-        response = minio_client.get_object(settings.minio_bucket, s3_object_path)
-        
-        # Write to temp file
-        with open(temp_file_path, 'wb') as f:
-            for chunk in response:
-                f.write(chunk)
-        
-        response.close()
-        response.release_conn()
-        
-        logger.info(f"Successfully downloaded {filename} to temp storage: {temp_file_path}")
-        return temp_file_path
-        
+        return await cache_maintainer.run_once()
     except Exception as e:
-        logger.error(f"Error downloading {filename} to temp storage: {e}")
+        logger.error(f"Error cleaning up temp files: {e}")
+        return None
+
+async def download_s3_file_to_temp(filename: str, from_peers: bool = True) -> Optional[CacheEntry]:
+    """Make sure a file is cached from S3 (or the replica owning it) and return its cache entry"""
+    s3_object = await resolve_s3_object(filename)
+    if not s3_object:
+        logger.error(f"File {filename} not found in S3 bucket {settings.minio_bucket}")
         return None
+    return await download_s3_object_to_temp(s3_object.key, from_peers)
+
+async def download_s3_object_to_temp(s3_key: str, from_peers: bool = True) -> Optional[CacheEntry]:
+    """Make sure an S3 object is cached and return its cache entry"""
+    # Serve straight from the cache while the copy was validated recently; a RAM-tier copy needs no disk check
+    entry = temp_cache.get(s3_key)
+    if entry and temp_cache.is_fresh(entry) and (temp_cache.in_memory(entry) or temp_cache.path_for(s3_key).exists()):
+        logger.info(f"Object {s3_key} already exists in temp storage")
+        temp_cache.touch(s3_key)
+        TEMP_CACHE_REQUESTS.labels("hit").inc()
+        return entry
+    
+    # Only one revalidation/S3 fetch runs per object; concurrent requests wait for its result
+    return await download_flights.do(s3_key, lambda: fetch_s3_file_to_temp(s3_key, from_peers))
+
+async def revalidate_temp_file(s3_key: str) -> bool:
+    """Check a cached object against S3 with a HEAD request; True when the local copy is current"""
+    entry = temp_cache.get(s3_key)
+    stat = await shared_fresh_version(s3_key)
+    if stat is None:
+        try:
+            stat = await storage.stat_object(s3_key)
+        except S3Error as e:
+            if e.code == "NoSuchKey":
+                object_index.remove(s3_key)
+                temp_cache.forget(s3_key)
+                await announce_object_change(s3_key, None)
+                return False
+            raise
+        if coordinator:
+            await coordinator.put_version(ObjectVersion.now(s3_key, stat.size, stat.etag, stat.last_modified))
+    object_index.put(s3_key, stat.size, stat.etag, stat.last_modified)
+    
+    if entry and entry.etag and entry.etag == stat.etag:
+        temp_cache.mark_validated(entry)
+        temp_cache.touch(s3_key)
+        return True
+    
+    logger.info(f"Cached copy of {s3_key} is stale, downloading new version from S3")
+    return False
 
-async def save_temp_file_to_s3(temp_file_path: Path, s3_path: str) -> bool:
-    """Save temporary file back to S3 at specified path"""
+async def fetch_s3_file_to_temp(s3_key: str, from_peers: bool = True) -> Optional[CacheEntry]:
+    """Fetch an object from S3 into temp storage via a partial file that is committed as a content-addressed blob"""
+    partial_path = temp_cache.new_partial()
     try:
-        if not temp_file_path.exists():
-            logger.error(f"Temp file does not exist: {temp_file_path}")
-            return False
+        # A cached copy only needs a cheap revalidation, not a full download
+        entry = temp_cache.get(s3_key)
+        if entry and (temp_cache.in_memory(entry) or temp_cache.path_for(s3_key).exists()):
+            if temp_cache.is_fresh(entry):
+                temp_cache.touch(s3_key)
+                TEMP_CACHE_REQUESTS.labels("hit").inc()
+                return entry
+            if await revalidate_temp_file(s3_key):
+                TEMP_CACHE_REQUESTS.labels("revalidated").inc()
+                return entry
         
-        with open(temp_file_path, 'rb') as file_data:
-            file_size = temp_file_path.stat().st_size
-            minio_client.put_object(
-                settings.minio_bucket,
-                s3_path,
-                file_data,
-                file_size
-            )
+        # Objects owned by another replica come from its cache, so S3 is read once per cluster
+        indexed = object_index.get(s3_key)
+        if from_peers and peer_fetcher:
+            peer_copy = await peer_fetcher.fetch(s3_key, partial_path, indexed.etag if indexed else None)
+            if peer_copy:
+                TEMP_CACHE_REQUESTS.labels("peer").inc()
+                return await temp_cache.commit(
+                    s3_key, partial_path, peer_copy.etag, indexed.last_modified if indexed else None, peer_copy.content_hash
+                )
         
-        logger.info(f"Successfully saved {temp_file_path.name} to S3 as {s3_path}")
-        return True
+        # Download the object from S3 to temp storage
+        logger.info(f"Downloading {s3_key} from S3 to temp storage...")
+        TEMP_CACHE_REQUESTS.labels("miss").inc()
+        try:
+            size, etag, digest = await storage.download_to_file(s3_key, partial_path)
+        except S3Error as e:
+            if e.code == "NoSuchKey":
+                # Object was removed outside this server; drop the stale index and cache entries
+                object_index.remove(s3_key)
+                temp_cache.forget(s3_key)
+                await announce_object_change(s3_key, None)
+                logger.error(f"Object {s3_key} no longer exists in S3")
+                return None
+            raise
+        
+        # Readers only ever see the complete file
+        entry = await temp_cache.commit(
+            s3_key, partial_path, etag or (indexed.etag if indexed else None), indexed.last_modified if indexed else None, digest
+        )
+        
+        logger.info(f"Successfully downloaded {s3_key} to temp storage: {temp_cache.path_for(s3_key)}")
+        return entry
         
     except Exception as e:
-        logger.error(f"Error saving temp file to S3: {e}")
-        return False
+        logger.error(f"Error downloading {s3_key} to temp storage: {e}")
+        return None
+    finally:
+        discard_partial(partial_path)
 
 async def find_original_s3_path(filename: str) -> Optional[str]:
     """Find the original S3 path for a filename"""
-    possible_paths = [f"uploads/{filename}", f"{filename}", f"documents/{filename}"]
-    
-    for path in possible_paths:
-        try:
-            minio_client.stat_object(settings.minio_bucket, path)
-            logger.info(f"Found original file at S3 path: {path}")
-            return path
-        except S3Error as e:
-            if e.code == "NoSuchKey":
-                continue
-            else:
-                logger.error(f"S3 Error for path {path}: {e}")
-                raise e
+    s3_object = await resolve_s3_object(filename)
+    if s3_object:
+        return s3_object.key
     
     logger.error(f"File {filename} not found in any S3 location")
     return None
 
-async def download_file_from_url(url: str) -> bytes:
-    """Download file from URL"""
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url)
-        response.raise_for_status()
-        return response.content
+async def parse_key(document_key: str) -> Tuple[str, Optional[str]]:
+    """Extract (filename, original S3 path) from a document key, resolving hashed keys for long paths"""
+    digest = hashed_key_digest(document_key)
+    s3_path = await save_store.get_key_path(digest) if digest else None
+    return parse_document_key(document_key, lambda _: s3_path)
+
+async def session_key_for(s3_path: str) -> Optional[str]:
+    """Document key of the open editing session for a document, on whichever replica it was opened"""
+    if coordinator:
+        # Callbacks may reach any replica, so only the shared record knows whether the session closed
+        return await coordinator.get_session(s3_path)
+    return editing_sessions.key_for(s3_path)
+
+async def open_editing_session(s3_path: str, document_key: str) -> None:
+    editing_sessions.open(s3_path, document_key)
+    if coordinator:
+        await coordinator.open_session(s3_path, document_key, editing_sessions.ttl_seconds)
 
-def generate_document_key() -> str:
-    """Generate unique document key"""
-    return str(uuid.uuid4())
+async def close_editing_session(s3_path: str, document_key: str) -> None:
+    editing_sessions.close(s3_path, document_key)
+    if coordinator:
+        await coordinator.close_session(s3_path, document_key)
+
+async def issue_document_key(s3_path: str, etag: Optional[str]) -> str:
+    """Version-aware document key; the path behind a hashed key is stored first so any replica can resolve it"""
+    document_key = generate_document_key(s3_path, etag)
+    digest = hashed_key_digest(document_key)
+    if digest and digest not in recorded_key_digests:
+        await save_store.put_key_path(digest, s3_path)
+        recorded_key_digests.add(digest)
+    return document_key
+
+def is_not_modified(request: Request, etag: str, last_modified: datetime) -> bool:
+    """Evaluate If-None-Match / If-Modified-Since (RFC 9110); True means a 304 can be sent"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Weak comparison; If-None-Match takes precedence over If-Modified-Since
+        if if_none_match.strip() == "*":
+            return True
+        candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return etag.removeprefix("W/") in candidates
+    
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        # A naive value (e.g. from a cache catalog written by an older version) is local time
+        return last_modified.astimezone(timezone.utc).replace(microsecond=0) <= since
+    
+    return False
+
+def encode_continuation_token(last_key: str) -> str:
+    """Opaque /documents and /temp-files continuation token for the S3 key a page ended at"""
+    return base64.urlsafe_b64encode(last_key.encode()).decode()
+
+def decode_continuation_token(token: str) -> str:
+    try:
+        return base64.urlsafe_b64decode(token.encode()).decode()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid continuation token")
+
+def document_entry(key: str, size: Optional[int], last_modified: Optional[datetime]) -> Dict[str, Any]:
+    """Listing entry for a single S3 object"""
+    filename = key.split('/')[-1]  # Get just the filename
+    return {
+        "name": key,
+        "filename": filename,
+        "size": size,
+        "last_modified": last_modified.isoformat() if last_modified else None,
+        "download_url": f"http://{settings.host_ip}:{settings.webhook_port}/download/{filename}",
+        "editor_url": f"http://{settings.host_ip}:{settings.webhook_port}/editor/{filename}"
+    }
 
 def get_file_extension(filename: str) -> str:
     """Get file extension"""
@@ -272,102 +675,62 @@ def generate_jwt_token(payload: dict) -> str:
 async def startup_event():
     """Initialize services on startup"""
     logger.info("Starting ONLYOFFICE MinIO API Server with temp file management...")
+    get_http_client()
     await ensure_bucket_exists()
+    loaded = temp_cache.load()
+    logger.info(f"Tracking {loaded} cached objects in {temp_cache.blob_count} blobs ({temp_cache.total_bytes} bytes)")
     await cleanup_old_temp_files()
+    cache_maintainer.start()
+    await save_queue.start()
+    if coordinator:
+        await coordinator.start(apply_remote_change)
+    if settings.s3_index_on_startup:
+        # Build the index in the background; lookups fall back to S3 probes until it is loaded
+        app.state.index_task = asyncio.create_task(refresh_object_index())
+    index_refresher.start()
     logger.info(f"Temporary files directory: {TEMP_DIR.absolute()}")
     logger.info(f"Server running on {settings.webhook_host}:{settings.webhook_port}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release shared resources on shutdown"""
+    await save_queue.drain(settings.save_queue_drain_timeout_seconds)
+    await index_refresher.stop()
+    await cache_maintainer.stop()
+    await warmups.stop()
+    temp_cache.close()
+    if coordinator:
+        await coordinator.close()
+    if http_client is not None:
+        await http_client.aclose()
+    storage.shutdown()
+
+root_page = ROOT_PAGE_TEMPLATE.substitute(
+    onlyoffice_server_url=settings.onlyoffice_server_url,
+    minio_endpoint=settings.minio_endpoint,
+    minio_bucket=settings.minio_bucket,
+    environment=settings.environment,
+    webhook_port=settings.webhook_port,
+)
+
 @app.get("/", response_class=HTMLResponse)
 async def root():
     """Root endpoint with API information"""
-    html_content = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>ONLYOFFICE MinIO API Server</title>
-        <style>
-            body {{ font-family: Arial, sans-serif; margin: 40px; background-color: #f5f5f5; }}
-            .container {{ background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }}
-            h1 {{ color: #333; }}
-            .status {{ padding: 10px; margin: 10px 0; border-radius: 4px; }}
-            .success {{ background-color: #d4edda; color: #155724; border: 1px solid #c3e6cb; }}
-            .info {{ background-color: #cce7ff; color: #004085; border: 1px solid #99d6ff; }}
-            a {{ color: #007bff; text-decoration: none; }}
-            a:hover {{ text-decoration: underline; }}
-            .endpoint {{ background-color: #f8f9fa; padding: 10px; margin: 5px 0; border-radius: 4px; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>🏢 ONLYOFFICE MinIO API Server</h1>
-            
-            <div class="status success">
-                ✅ Server is running successfully!
-            </div>
-            
-            <h2>📋 Configuration</h2>
-            <div class="info">
-                <strong>ONLYOFFICE Server:</strong> {settings.onlyoffice_server_url}<br>
-                <strong>MinIO Endpoint:</strong> {settings.minio_endpoint}<br>
-                <strong>Storage Bucket:</strong> {settings.minio_bucket}<br>
-                <strong>Environment:</strong> {settings.environment}
-            </div>
-            
-            <h2>🔗 API Endpoints</h2>
-            <div class="endpoint"><strong>GET</strong> <a href="/docs">/docs</a> - Interactive API Documentation</div>
-            <div class="endpoint"><strong>GET</strong> <a href="/health">/health</a> - Health Check</div>
-            <div class="endpoint"><strong>POST</strong> /webhook/callback - ONLYOFFICE Document Callback</div>
-            <div class="endpoint"><strong>POST</strong> /upload - Upload File to S3</div>
-            <div class="endpoint"><strong>GET</strong> /download/{{filename}} - Download File from Temp Storage</div>
-            <div class="endpoint"><strong>GET</strong> /documents - List Documents in S3</div>
-            <div class="endpoint"><strong>GET</strong> /temp-files - List Temporary Files</div>
-            <div class="endpoint"><strong>POST</strong> /cleanup-temp-files - Clean Up Old Temp Files</div>
-            <div class="endpoint"><strong>DELETE</strong> /temp-files/{{filename}} - Delete Specific Temp File</div>
-            <div class="endpoint"><strong>GET</strong> /editor/{{filename}} - Document Editor</div>
-            <div class="endpoint"><strong>GET</strong> /editor/{{filename}}?user_id={{id}}&username={{name}}&readonly={{true/false}} - Document Editor with User & Permissions</div>
-            
-            <h2>🧪 Test Links</h2>
-            <p><a href="/health">Health Check</a></p>
-            <p><a href="/documents">List Documents in S3</a></p>
-            <p><a href="/temp-files">List Temporary Files</a></p>
-            <p><a href="/docs">API Documentation</a></p>
-            
-            <h2>👥 Real-time Collaboration Testing</h2>
-            <p>To test collaboration with different permission levels, open the same document with different users:</p>
-            <div class="endpoint">
-                <strong>Editor 1 (Full Access):</strong> <code>/editor/document.docx?user_id=1&username=Alice</code><br>
-                <strong>Editor 2 (Full Access):</strong> <code>/editor/document.docx?user_id=2&username=Bob</code><br>
-                <strong>Viewer (Read-Only):</strong> <code>/editor/document.docx?user_id=3&username=Charlie&readonly=true</code>
-            </div>
-            <p><small>Replace "document.docx" with your actual filename.</small></p>
-            <h3>📋 Permission Levels:</h3>
-            <div class="endpoint">
-                <strong>✏️ Edit Mode:</strong> Can edit, comment, review, fill forms<br>
-                <strong>📖 Read-Only:</strong> Can only view and download (no editing, commenting, or reviewing)
-            </div>
-            
-            <h2>📱 ONLYOFFICE Integration</h2>
-            <p>Webhook URL for ONLYOFFICE: <code>http://localhost:{settings.webhook_port}/webhook/callback</code></p>
-            <p>Access ONLYOFFICE: <a href="{settings.onlyoffice_server_url}" target="_blank">{settings.onlyoffice_server_url}</a></p>
-        </div>
-    </body>
-    </html>
-    """
-    return HTMLResponse(content=html_content)
+    # Rendered once at import: the page only depends on settings
+    return HTMLResponse(content=root_page)
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     try:
         # Test MinIO connection
-        bucket_exists = minio_client.bucket_exists(settings.minio_bucket)
+        bucket_exists = await storage.bucket_exists()
         
         # Test ONLYOFFICE connection
         onlyoffice_status = "unknown"
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{settings.onlyoffice_server_url}/healthcheck", timeout=5)
-                onlyoffice_status = "healthy" if response.status_code == 200 else "unhealthy"
+            response = await get_http_client().get(f"{settings.onlyoffice_server_url}/healthcheck", timeout=5)
+            onlyoffice_status = "healthy" if response.status_code == 200 else "unhealthy"
         except:
             onlyoffice_status = "unreachable"
         
@@ -378,6 +741,12 @@ async def health_check():
                 "minio": "healthy" if bucket_exists else "unhealthy",
                 "onlyoffice": onlyoffice_status
             },
+            "save_queue_depth": save_queue.depth,
+            "coordination": {
+                "backend": settings.coordination_backend,
+                "instance_id": coordinator.instance_id if coordinator else None,
+                "invalidations_received": coordinator.invalidations_received if coordinator else 0
+            },
             "config": {
                 "bucket": settings.minio_bucket,
                 "onlyoffice_url": settings.onlyoffice_server_url
@@ -387,8 +756,15 @@ async def health_check():
         logger.error(f"Health check failed: {e}")
         raise HTTPException(status_code=503, detail=f"Service unhealthy: {str(e)}")
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus metrics"""
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.post("/webhook/callback")
-async def onlyoffice_callback(callback: DocumentCallback, background_tasks: BackgroundTasks):
+async def onlyoffice_callback(callback: DocumentCallback):
     """Handle ONLYOFFICE document callbacks"""
     logger.info(f"Received callback for document {callback.key}, status: {callback.status}")
     
@@ -402,10 +778,22 @@ async def onlyoffice_callback(callback: DocumentCallback, background_tasks: Back
         # 6 - document being edited, but current document state is saved
         # 7 - force save request error
         
+        # Keep the file pinned in the temp cache, and its document key fixed, while an editing session is open
+        filename, original_s3_path = await parse_key(callback.key)
+        if not original_s3_path:
+            indexed = object_index.lookup(filename)
+            original_s3_path = indexed.key if indexed else None
+        if original_s3_path and callback.status == 1:
+            temp_cache.pin(original_s3_path, settings.temp_cache_pin_hours * 3600)
+            await open_editing_session(original_s3_path, callback.key)
+        elif original_s3_path and callback.status in (2, 4):
+            temp_cache.unpin(original_s3_path)
+            await close_editing_session(original_s3_path, callback.key)
+        
         if callback.status == 2 or callback.status == 6:  # Document ready for saving or force save
             if callback.url:
                 # Download and save document to MinIO
-                background_tasks.add_task(save_document_to_minio, callback.key, callback.url)
+                await save_queue.enqueue(callback.key, callback.url)
                 logger.info(f"Queued document {callback.key} for saving to MinIO")
         
         # Always return success to ONLYOFFICE
@@ -415,119 +803,283 @@ async def onlyoffice_callback(callback: DocumentCallback, background_tasks: Back
         logger.error(f"Callback processing error: {e}")
         return {"error": 1, "message": str(e)}
 
-async def save_document_to_minio(document_key: str, download_url: str):
+async def save_document_to_minio(document_key: str, download_url: str) -> bool:
     """
-    Save document from ONLYOFFICE to temporary storage and then back to original S3 location.
+    Stream document from ONLYOFFICE back to its original S3 location, teeing it into temporary storage.
+    
+    The download is piped straight into an S3 multipart upload, so memory use
+    stays constant and the file is transferred once regardless of its size.
     
     This ensures proper revision handling:
     - Files are saved back to their original S3 path (uploads/, documents/, or root)
     - Changes appear as updates to the original file, not as separate copies
     - Maintains proper file versioning and history
     
-    Document key format: doc_{uuid}_{base64_s3_path}_{filename}
+    Document key format: v2.{version}.{base64_s3_path} (see document_keys)
+    
+    Returns True once the document is stored in S3, so the save queue can retry failures.
     """
     try:
-        logger.info(f"Downloading document {document_key} from {download_url}")
-        
-        # Download document content
-        file_content = await download_file_from_url(download_url)
-        
-        # Extract filename and original S3 path from document key 
-        # Format: doc_<uuid>_<base64_s3_path>_<filename>
-        if document_key.startswith("doc_") and document_key.count("_") >= 3:
-            parts = document_key.split("_", 3)  # Split into max 4 parts: ['doc', uuid, s3_path, filename]
-            if len(parts) >= 4:
-                encoded_s3_path = parts[2]
-                filename = parts[3]
-                
-                # Decode the S3 path from base64
-                try:
-                    original_s3_path = base64.b64decode(encoded_s3_path.encode()).decode()
-                except:
-                    # Fallback: find the original path
-                    original_s3_path = await find_original_s3_path(filename)
-            else:
-                # Fallback for old format
-                filename = document_key.split("_", 2)[-1] if "_" in document_key else f"document_{document_key}.docx"
-                original_s3_path = await find_original_s3_path(filename)
-        else:
-            # Fallback for old format
-            filename = document_key.split("_", 2)[-1] if "_" in document_key else f"document_{document_key}.docx"
+        # Extract filename and original S3 path from document key
+        filename, original_s3_path = await parse_key(document_key)
+        if not original_s3_path:
+            # Fallback: find the original path
             original_s3_path = await find_original_s3_path(filename)
         
         if not original_s3_path:
             logger.error(f"Could not determine original S3 path for {filename}")
-            return
-        
-        # Save to temporary storage first
-        temp_file_path = TEMP_DIR / filename
-        with open(temp_file_path, 'wb') as f:
-            f.write(file_content)
-        
-        logger.info(f"Document saved to temp storage: {temp_file_path}")
+            return False
         
-        # Save back to original S3 location (this creates a revision of the original file)
-        success = await save_temp_file_to_s3(temp_file_path, original_s3_path)
+        logger.info(f"Streaming document {document_key} from {download_url} to {original_s3_path}")
         
-        if success:
+        # Tee into a partial temp file; it only replaces the cached copy once S3 has the new version,
+        # so a concurrent revalidation can never overwrite unsaved edits with the old version
+        partial_path = temp_cache.new_partial()
+        try:
+            # Content-Length only sizes the upload when the body arrives as sent, not decompressed
+            async with get_http_client().stream("GET", download_url, headers={"Accept-Encoding": "identity"}) as response:
+                response.raise_for_status()
+                encoded = response.headers.get("Content-Encoding", "identity").lower() != "identity"
+                length = -1 if encoded else int(response.headers.get("Content-Length", -1))
+                
+                # Save back to original S3 location (this creates a revision of the original file);
+                # a body that does not match its Content-Length fails the save so it is retried
+                result, file_size, digest = await storage.put_stream(
+                    original_s3_path,
+                    response.aiter_bytes(256 * 1024),
+                    length,
+                    tee_path=partial_path if settings.callback_save_tee_to_cache else None
+                )
+            
+            saved = object_index.put(original_s3_path, file_size, result.etag)
+            SAVED_DOCUMENT_BYTES.observe(file_size)
+            editor_pages.invalidate(original_s3_path)
+            await announce_object_change(original_s3_path, saved)
+            if settings.callback_save_tee_to_cache:
+                await temp_cache.commit(original_s3_path, partial_path, result.etag, digest=digest)
+                logger.info(f"Document saved to temp storage: {temp_cache.path_for(original_s3_path)}")
+            else:
+                # The cached copy is now outdated; the next access revalidates and refetches it
+                temp_cache.invalidate(original_s3_path)
+            
             logger.info(f"Document successfully saved back to original S3 location: {original_s3_path}")
-        else:
-            logger.error(f"Failed to save document {filename} back to S3")
+            return True
+        finally:
+            discard_partial(partial_path)
         
     except Exception as e:
         logger.error(f"Error saving document {document_key}: {e}")
+        return False
+
+# Pending saves and the paths behind hashed document keys, persisted in the configured backend
+save_store = create_save_store(
+    settings.save_queue_backend,
+    settings.save_queue_sqlite_path,
+    settings.redis_host,
+    settings.redis_port,
+    settings.redis_db,
+    settings.save_queue_lease_seconds
+)
+# Digests already written to save_store by this process
+recorded_key_digests: Set[str] = set()
+
+# Callback saves run on a bounded worker pool, coalesced per document key
+save_queue = SaveQueue(
+    save_document_to_minio,
+    save_store,
+    workers=settings.save_queue_workers,
+    max_attempts=settings.save_queue_max_attempts,
+    retry_base_seconds=settings.save_queue_retry_base_seconds,
+    retry_max_seconds=settings.save_queue_retry_max_seconds
+)
+
+SAVE_QUEUE_DEPTH.set_function(lambda: save_queue.depth)
+
+@app.get("/save-queue")
+async def save_queue_status():
+    """Callback save queue depth, outcomes and save latency"""
+    return save_queue.stats()
+
+def uploaded_file_size(file: UploadFile) -> int:
+    """Size of an uploaded file; the multipart body is spooled to disk by the server, so measure it without reading it"""
+    file.file.seek(0, os.SEEK_END)
+    size = file.file.tell()
+    file.file.seek(0)
+    return size
+
+async def store_upload(original_filename: str, data: BinaryIO, size: int, content_type: Optional[str]) -> UploadResponse:
+    """Stream one uploaded file to uploads/ under a unique name and register it"""
+    # Generate unique filename
+    file_extension = get_file_extension(original_filename)
+    unique_filename = f"{uuid.uuid4()}{file_extension}"
+    object_name = f"uploads/{unique_filename}"
+    
+    # Stream to MinIO in bounded-size parts instead of reading the whole file into memory
+    result = await storage.put_object(
+        object_name,
+        data,
+        size,
+        content_type=content_type or "application/octet-stream"
+    )
+    uploaded = object_index.put(object_name, size, result.etag)
+    editor_pages.invalidate(object_name)
+    await announce_object_change(object_name, uploaded)
+    
+    # Generate download URL
+    download_url = f"http://localhost:{settings.webhook_port}/download/{unique_filename}"
+    
+    logger.info(f"Uploaded file {original_filename} as {unique_filename}")
+    
+    return UploadResponse(
+        filename=original_filename,
+        key=unique_filename,
+        url=download_url,
+        size=size,
+        bucket=settings.minio_bucket
+    )
 
 @app.post("/upload", response_model=UploadResponse)
 async def upload_file(file: UploadFile = File(...)):
     """Upload file to MinIO storage"""
     try:
         await ensure_bucket_exists()
-        
-        # Generate unique filename
-        file_extension = get_file_extension(file.filename)
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        object_name = f"uploads/{unique_filename}"
-        
-        # Read file content
-        file_content = await file.read()
-        
-        # Upload to MinIO
-        minio_client.put_object(
-            settings.minio_bucket,
-            object_name,
-            data=io.BytesIO(file_content),
-            length=len(file_content),
-            content_type=file.content_type or "application/octet-stream"
-        )
-        
-        # Generate download URL
-        download_url = f"http://localhost:{settings.webhook_port}/download/{unique_filename}"
-        
-        logger.info(f"Uploaded file {file.filename} as {unique_filename}")
-        
-        return UploadResponse(
-            filename=file.filename,
-            key=unique_filename,
-            url=download_url,
-            size=len(file_content),
-            bucket=settings.minio_bucket
-        )
+        return await store_upload(file.filename, file.file, uploaded_file_size(file), file.content_type)
         
     except Exception as e:
         logger.error(f"Upload error: {e}")
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
-@app.get("/download/{filename}")
-async def download_file(filename: str):
-    """Download file from temporary storage (downloads from S3 if not cached)"""
+# (original filename, size, content type, opener returning the readable data)
+BatchItem = Tuple[str, int, Optional[str], Callable[[], ContextManager[BinaryIO]]]
+
+def batch_upload_items(files: List[UploadFile], expand_archives: bool) -> Tuple[List[BatchItem], List[zipfile.ZipFile]]:
+    """Flatten a batch upload into individual files, expanding .zip archives into their members; returns the opened archives too"""
+    items: List[BatchItem] = []
+    archives: List[zipfile.ZipFile] = []
+    for file in files:
+        if expand_archives and get_file_extension(file.filename) == ".zip" and zipfile.is_zipfile(file.file):
+            archive = zipfile.ZipFile(file.file)
+            archives.append(archive)
+            for member in archive.infolist():
+                if member.is_dir():
+                    continue
+                content_type = mimetypes.guess_type(member.filename)[0]
+                items.append((member.filename, member.file_size, content_type, lambda member=member, archive=archive: archive.open(member)))
+        else:
+            file.file.seek(0)
+            items.append((file.filename, uploaded_file_size(file), file.content_type, lambda file=file: nullcontext(file.file)))
+    return items, archives
+
+@app.post("/upload/batch")
+async def upload_files_batch(
+    files: List[UploadFile] = File(...),
+    expand_archives: bool = Form(True),
+    format: str = Query("ndjson", pattern="^(json|ndjson)$")
+):
+    """
+    Upload many files in one request.
+    
+    .zip archives are expanded into their members unless expand_archives is
+    false. Files go to S3 upload_batch_concurrency at a time. With
+    format=ndjson (the default) each file's result is streamed as one JSON
+    object per line as soon as its upload completes; format=json returns all
+    results, in request order, once the batch is done.
+    """
+    if not await ensure_bucket_exists():
+        raise HTTPException(status_code=503, detail=f"Bucket {settings.minio_bucket} is not available")
+    items, archives = batch_upload_items(files, expand_archives)
+    slots = asyncio.Semaphore(settings.upload_batch_concurrency)
+    
+    async def upload_item(index: int, item: BatchItem) -> Dict[str, Any]:
+        filename, size, content_type, open_data = item
+        async with slots:
+            try:
+                with open_data() as data:
+                    uploaded = await store_upload(filename, data, size, content_type)
+                return {"index": index, "status": "uploaded", **uploaded.model_dump()}
+            except Exception as e:
+                logger.error(f"Batch upload of {filename} failed: {e}")
+                return {"index": index, "status": "failed", "filename": filename, "error": str(e)}
+    
+    start = time.perf_counter()
+    tasks = [asyncio.ensure_future(upload_item(index, item)) for index, item in enumerate(items)]
+    logger.info(f"Uploading batch of {len(items)} files from {len(files)} parts")
+    
+    def close_archives():
+        for archive in archives:
+            archive.close()
+    
+    if format == "ndjson":
+        # Form files stay open until the response is sent (FastAPI >= 0.118), so the uploads can outlive the handler
+        async def stream_results():
+            try:
+                for next_result in asyncio.as_completed(tasks):
+                    yield json.dumps(await next_result) + "\n"
+            finally:
+                for task in tasks:
+                    task.cancel()
+                close_archives()
+        
+        return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+    
     try:
-        # First, try to download the file to temp storage if not already there
-        temp_file_path = await download_s3_file_to_temp(filename)
+        results = await asyncio.gather(*tasks)
+    finally:
+        close_archives()
+    uploaded = [result for result in results if result["status"] == "uploaded"]
+    return {
+        "results": results,
+        "uploaded": len(uploaded),
+        "failed": len(results) - len(uploaded),
+        "bytes": sum(result["size"] for result in uploaded),
+        "seconds": round(time.perf_counter() - start, 3)
+    }
+
+def stat_cached_file(path: Path) -> Optional[os.stat_result]:
+    """One stat of a cached blob; None when it is gone (e.g. evicted meanwhile)"""
+    try:
+        return path.stat()
+    except FileNotFoundError:
+        return None
+
+@app.api_route("/download/{filename}", methods=["GET", "HEAD"])
+async def download_file(filename: str, request: Request):
+    """
+    Download file from temporary storage (downloads from S3 if not cached).
+    
+    Responses carry the source object's ETag and Last-Modified, answer
+    conditional requests with 304 and honour single and multi-part Range requests.
+    """
+    try:
+        # Let the client fetch the bytes from S3 directly instead of through this server
+        if settings.download_mode in ("redirect", "presigned"):
+            s3_object = await resolve_s3_object(filename)
+            if not s3_object:
+                raise HTTPException(status_code=404, detail=f"File not found: {filename}")
+            presigned_url = await presigned_urls.get(s3_object.key)
+            logger.info(f"Redirecting download of {filename} to presigned S3 URL")
+            return RedirectResponse(
+                presigned_url,
+                status_code=307,
+                headers={"Access-Control-Allow-Origin": "*", "Cache-Control": "no-store"}
+            )
         
-        if not temp_file_path or not temp_file_path.exists():
+        # First, try to download the file to temp storage if not already there
+        entry = await download_s3_file_to_temp(filename)
+        if not entry:
             logger.error(f"Could not retrieve file {filename} from S3 or temp storage")
             raise HTTPException(status_code=404, detail=f"File not found: {filename}")
         
+        # A RAM-tier copy is answered from the entry's size and validators without touching the disk
+        temp_file_path = temp_cache.path_for(entry.s3_key)
+        in_memory = "range" not in request.headers and temp_cache.in_memory(entry)
+        file_stat = None
+        if not in_memory or not entry.last_modified:
+            file_stat = stat_cached_file(temp_file_path)
+            if file_stat is None:
+                logger.error(f"Could not retrieve file {filename} from S3 or temp storage")
+                raise HTTPException(status_code=404, detail=f"File not found: {filename}")
+        
         # Get content type based on file extension
         file_extension = get_file_extension(filename).lower()
         content_type = "application/octet-stream"
@@ -543,22 +1095,59 @@ async def download_file(filename: str):
         elif file_extension in ['.txt']:
             content_type = "text/plain"
         
+        # Validators come from the S3 object the cached copy was fetched from
+        if entry.etag:
+            etag = f'"{entry.etag}"'
+        else:
+            etag = f'"{file_stat.st_size:x}-{int(file_stat.st_mtime):x}"'
+        last_modified = entry.last_modified or datetime.fromtimestamp(file_stat.st_mtime, tz=timezone.utc)
+        
+        headers = {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET, HEAD, OPTIONS",
+            "Access-Control-Allow-Headers": "Content-Type, Range, Authorization, If-None-Match, If-Modified-Since, If-Range",
+            "Access-Control-Expose-Headers": "Content-Length, Content-Range, Accept-Ranges, ETag, Last-Modified",
+            # Clients may keep a copy but must revalidate it on every use
+            "Cache-Control": "no-cache",
+            "ETag": etag,
+            "Last-Modified": format_datetime(last_modified.astimezone(timezone.utc), usegmt=True),
+            "Accept-Ranges": "bytes"
+        }
+        
+        if is_not_modified(request, etag, last_modified):
+            logger.info(f"File {filename} not modified, answering 304")
+            return Response(status_code=304, headers=headers)
+        
+        # Hot small files are answered from the RAM tier; Range requests always go to the disk tier
+        buffer = None if "range" in request.headers else temp_cache.buffer_for(entry.s3_key)
+        if buffer is not None and len(buffer) == entry.size:
+            SERVED_DOCUMENT_BYTES.observe(len(buffer))
+            logger.info(f"Serving file {filename} from memory")
+            quoted_filename = quote(filename)
+            if quoted_filename != filename:
+                headers["Content-Disposition"] = f"attachment; filename*=utf-8''{quoted_filename}"
+            else:
+                headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+            return Response(content=buffer, media_type=content_type, headers=headers)
+        
+        if file_stat is None:
+            file_stat = stat_cached_file(temp_file_path)
+            if file_stat is None:
+                raise HTTPException(status_code=404, detail=f"File not found: {filename}")
+        SERVED_DOCUMENT_BYTES.observe(file_stat.st_size)
         logger.info(f"Serving file {filename} from temp storage: {temp_file_path}")
         
-        # Serve the file from temporary storage using FileResponse
-        return FileResponse(
+        # FileResponse keeps our ETag/Last-Modified and handles Range and If-Range against them.
+        # Servers offering the ASGI pathsend extension send whole files with sendfile()
+        response = FileResponse(
             path=str(temp_file_path),
             media_type=content_type,
             filename=filename,
-            headers={
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET, HEAD, OPTIONS",
-                "Access-Control-Allow-Headers": "Content-Type, Range, Authorization",
-                "Access-Control-Expose-Headers": "Content-Length, Accept-Ranges",
-                "Cache-Control": "no-cache, no-store, must-revalidate",
-                "Accept-Ranges": "bytes"
-            }
+            stat_result=file_stat,
+            headers=headers
         )
+        response.chunk_size = settings.temp_cache_disk_chunk_size_kb * 1024
+        return response
         
     except HTTPException:
         raise
@@ -574,85 +1163,262 @@ async def download_options(filename: str):
         headers={
             "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Methods": "GET, HEAD, OPTIONS",
-            "Access-Control-Allow-Headers": "Content-Type, Range, Authorization",
+            "Access-Control-Allow-Headers": "Content-Type, Range, Authorization, If-None-Match, If-Modified-Since, If-Range",
             "Access-Control-Max-Age": "86400",
         }
     )
 
 @app.get("/documents")
-async def list_documents():
-    """List all documents in MinIO bucket"""
+async def list_documents(
+    prefix: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=10000),
+    continuation_token: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$")
+):
+    """
+    List documents in MinIO bucket, one page at a time.
+    
+    Pass the returned next_continuation_token to fetch the following page.
+    With format=ndjson, entries are streamed one JSON object per line as S3
+    returns them, across all pages unless a limit is given.
+    """
+    start_after = decode_continuation_token(continuation_token) if continuation_token else None
+    
+    # Served from the in-memory index while it is fresh; S3 is listed only when it is not
+    from_cache = object_index.is_fresh(settings.documents_cache_ttl_seconds)
+    
+    if format == "ndjson":
+        async def stream_entries():
+            sent = 0
+            if from_cache:
+                cursor = start_after
+                while limit is None or sent < limit:
+                    page = object_index.page(prefix, cursor, 1000)
+                    if not page:
+                        return
+                    for entry in page:
+                        if limit is not None and sent >= limit:
+                            return
+                        yield json.dumps(document_entry(entry.key, entry.size, entry.last_modified)) + "\n"
+                        sent += 1
+                    cursor = page[-1].key
+                    await asyncio.sleep(0)
+                return
+            async for batch in storage.iter_objects(prefix=prefix, start_after=start_after):
+                for obj in batch:
+                    if limit is not None and sent >= limit:
+                        return
+                    yield json.dumps(document_entry(obj.object_name, obj.size, obj.last_modified)) + "\n"
+                    sent += 1
+        
+        return StreamingResponse(stream_entries(), media_type="application/x-ndjson")
+    
     try:
-        objects = minio_client.list_objects(settings.minio_bucket, recursive=True)
+        page_size = limit or settings.documents_page_size
         documents = []
+        is_truncated = False
         
-        for obj in objects:
-            filename = obj.object_name.split('/')[-1]  # Get just the filename
-            
-            documents.append({
-                "name": obj.object_name,
-                "filename": filename,
-                "size": obj.size,
-                "last_modified": obj.last_modified.isoformat() if obj.last_modified else None,
-                "download_url": f"http://{settings.host_ip}:{settings.webhook_port}/download/{filename}",
-                "editor_url": f"http://{settings.host_ip}:{settings.webhook_port}/editor/{filename}"
-            })
+        if from_cache:
+            page = object_index.page(prefix, start_after, page_size + 1)
+            is_truncated = len(page) > page_size
+            documents = [document_entry(entry.key, entry.size, entry.last_modified) for entry in page[:page_size]]
+        else:
+            # Fetch one entry beyond the page to learn whether another page exists
+            async for batch in storage.iter_objects(prefix=prefix, start_after=start_after, batch_size=min(page_size + 1, 1000)):
+                for obj in batch:
+                    if len(documents) == page_size:
+                        is_truncated = True
+                        break
+                    documents.append(document_entry(obj.object_name, obj.size, obj.last_modified))
+                if is_truncated:
+                    break
         
-        return {"documents": documents, "count": len(documents)}
+        return {
+            "documents": documents,
+            "count": len(documents),
+            "is_truncated": is_truncated,
+            "next_continuation_token": encode_continuation_token(documents[-1]["name"]) if is_truncated else None,
+            "cached": from_cache
+        }
         
     except Exception as e:
         logger.error(f"Error listing documents: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to list documents: {str(e)}")
 
+async def serve_peer_object(s3_key: str, request: Request, etag: Optional[str] = None):
+    """Serve this replica's cached copy to another replica, filling it from S3 (never from a peer) on a miss"""
+    peer = request.headers.get(PEER_REQUEST_HEADER, "")
+    if not peer_fetcher.verify(peer, s3_key, request.headers.get(PEER_SIGNATURE_HEADER, "")):
+        logger.warning(f"Rejected unsigned or unknown peer request for {s3_key} from {peer or request.client}")
+        raise HTTPException(status_code=403, detail="Peer requests only")
+    
+    # The requesting replica already knows a different version: check ours against S3 first
+    entry = temp_cache.get(s3_key)
+    if etag and entry and entry.etag != etag:
+        temp_cache.invalidate(s3_key)
+    
+    entry = await download_s3_object_to_temp(s3_key, from_peers=False)
+    if not entry:
+        raise HTTPException(status_code=404, detail=f"Object not found: {s3_key}")
+    
+    headers = {S3_KEY_HEADER: entry.s3_key}
+    if entry.etag:
+        headers["ETag"] = f'"{entry.etag}"'
+    return FileResponse(path=temp_cache.path_for(s3_key), media_type="application/octet-stream", headers=headers)
+
+# Only replicas configured for peer fill expose their cache to each other
+if peer_fetcher:
+    app.add_api_route("/peer/objects/{s3_key:path}", serve_peer_object, methods=["GET"], include_in_schema=False)
+
 @app.get("/temp-files")
-async def list_temp_files():
-    """List all files in temporary storage"""
+async def list_temp_files(
+    limit: int = Query(1000, ge=1, le=10000),
+    continuation_token: Optional[str] = None
+):
+    """
+    List files in temporary storage, one page at a time in S3 key order.
+    
+    Pages are read from the cache catalog, never from the directory tree.
+    Pass the returned next_continuation_token to fetch the following page.
+    """
+    start_after = decode_continuation_token(continuation_token) if continuation_token else None
     try:
-        temp_files = []
-        
-        for temp_file in TEMP_DIR.glob("*"):
-            if temp_file.is_file():
-                stat = temp_file.stat()
-                temp_files.append({
-                    "filename": temp_file.name,
-                    "size": stat.st_size,
-                    "created": datetime.fromtimestamp(stat.st_ctime).isoformat(),
-                    "modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                    "age_hours": (datetime.now() - datetime.fromtimestamp(stat.st_mtime)).total_seconds() / 3600
-                })
+        entries = temp_cache.page(start_after, limit + 1)
+        is_truncated = len(entries) > limit
+        entries = entries[:limit]
+        
+        temp_files = [{
+            "filename": entry.filename,
+            "s3_key": entry.s3_key,
+            "content_hash": entry.content_hash,
+            "etag": entry.etag,
+            "size": entry.size,
+            "last_accessed": datetime.fromtimestamp(entry.last_access).isoformat(),
+            "idle_hours": (time.time() - entry.last_access) / 3600,
+            "hits": entry.hits,
+            "pinned": temp_cache.is_pinned(entry.s3_key)
+        } for entry in entries]
         
         return {
             "temp_files": temp_files, 
             "count": len(temp_files),
+            "is_truncated": is_truncated,
+            "next_continuation_token": encode_continuation_token(entries[-1].s3_key) if is_truncated else None,
+            "total_count": len(temp_cache),
             "temp_directory": str(TEMP_DIR.absolute()),
-            "ttl_hours": settings.temp_file_ttl_hours
+            "ttl_hours": settings.temp_file_ttl_hours,
+            "total_bytes": temp_cache.total_bytes,
+            "blobs": temp_cache.blob_count,
+            "deduplicated_bytes": temp_cache.entry_bytes - temp_cache.total_bytes,
+            "max_bytes": settings.temp_cache_max_bytes,
+            "max_entries": settings.temp_cache_max_entries,
+            "memory_tier": {
+                "bytes": temp_cache.memory.total_bytes,
+                "files": len(temp_cache.memory),
+                "max_bytes": settings.temp_cache_memory_max_bytes,
+                "max_object_bytes": settings.temp_cache_memory_max_object_bytes
+            },
+            "maintenance": {
+                "interval_seconds": settings.temp_cache_maintenance_interval_seconds,
+                "runs": cache_maintainer.runs,
+                "last_run": cache_maintainer.last_report
+            },
+            "peer_fill": peer_fetcher.stats() if peer_fetcher else None
         }
         
     except Exception as e:
         logger.error(f"Error listing temp files: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to list temp files: {str(e)}")
 
+async def select_warmup_keys(request: WarmupRequest, limit: int) -> List[str]:
+    """S3 keys a warm-up request selects; objects filtered by modification time come newest first"""
+    selected: Dict[str, None] = {}
+    for name in request.keys or []:
+        s3_object = None if "/" in name or object_index.get(name) else await resolve_s3_object(name)
+        # Unknown names are kept and reported as failures by the job
+        selected[s3_object.key if s3_object else name] = None
+    
+    if request.prefix is not None or request.modified_within_hours is not None:
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=request.modified_within_hours) if request.modified_within_hours else None
+        listed: List[Tuple[str, Optional[datetime]]] = []
+        if object_index.is_fresh(settings.documents_cache_ttl_seconds):
+            cursor = None
+            while cutoff or len(listed) < limit:
+                page = object_index.page(request.prefix, cursor, 1000)
+                if not page:
+                    break
+                listed.extend((entry.key, entry.last_modified) for entry in page)
+                cursor = page[-1].key
+                await asyncio.sleep(0)
+        else:
+            async for batch in storage.iter_objects(prefix=request.prefix):
+                listed.extend((obj.object_name, obj.last_modified) for obj in batch if not obj.object_name.endswith("/"))
+                if not cutoff and len(listed) >= limit:
+                    break
+        if cutoff:
+            listed = [(key, modified) for key, modified in listed if modified and modified >= cutoff]
+            listed.sort(key=lambda item: item[1], reverse=True)
+        for key, _ in listed:
+            selected.setdefault(key, None)
+    
+    return list(selected)[:limit]
+
+@app.post("/temp-files/warmup", status_code=202)
+async def start_cache_warmup(request: WarmupRequest):
+    """
+    Start prefetching objects into the temp cache in the background.
+    
+    Objects are selected by prefix, by an explicit list of keys, by
+    modification within the last N hours, or a combination. The selection is
+    capped at TEMP_CACHE_MAX_ENTRIES, so a warm-up never evicts its own
+    objects. Poll GET /temp-files/warmup/{job_id} for progress.
+    """
+    if request.prefix is None and not request.keys and request.modified_within_hours is None:
+        raise HTTPException(status_code=400, detail="Give a prefix, keys or modified_within_hours")
+    limit = min(request.limit or settings.temp_cache_max_entries, settings.temp_cache_max_entries)
+    job = warmups.start(
+        request.model_dump(exclude_none=True),
+        lambda: select_warmup_keys(request, limit),
+        request.concurrency or settings.warmup_concurrency
+    )
+    return job.to_dict()
+
+@app.get("/temp-files/warmup")
+async def list_cache_warmups():
+    """Recent warm-up jobs and their progress"""
+    return {"jobs": [job.to_dict() for job in warmups]}
+
+@app.get("/temp-files/warmup/{job_id}")
+async def get_cache_warmup(job_id: str):
+    """Progress of one warm-up job"""
+    job = warmups.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Warm-up job not found: {job_id}")
+    return job.to_dict()
+
 @app.post("/cleanup-temp-files")
 async def cleanup_temp_files_manual():
     """Manually trigger cleanup of old temporary files"""
     try:
-        await cleanup_old_temp_files()
-        return {"message": "Temp file cleanup completed", "timestamp": datetime.now().isoformat()}
+        report = await cleanup_old_temp_files()
+        return {"message": "Temp file cleanup completed", "timestamp": datetime.now().isoformat(), "report": report}
     except Exception as e:
         logger.error(f"Error during manual temp cleanup: {e}")
         raise HTTPException(status_code=500, detail=f"Cleanup failed: {str(e)}")
 
-@app.delete("/temp-files/{filename}")
+@app.delete("/temp-files/{filename:path}")
 async def delete_temp_file(filename: str):
-    """Delete a specific temporary file"""
+    """Delete a specific temporary file, by S3 key or by filename"""
     try:
-        temp_file_path = TEMP_DIR / filename
+        s3_key = filename
+        if not temp_cache.get(s3_key):
+            indexed = object_index.lookup(filename)
+            s3_key = indexed.key if indexed else None
         
-        if not temp_file_path.exists():
+        if not s3_key or not temp_cache.forget(s3_key):
             raise HTTPException(status_code=404, detail=f"Temp file not found: {filename}")
         
-        temp_file_path.unlink()
-        logger.info(f"Deleted temp file: {filename}")
+        logger.info(f"Deleted temp file: {s3_key}")
         
         return {"message": f"Temp file {filename} deleted successfully"}
         
@@ -662,249 +1428,157 @@ async def delete_temp_file(filename: str):
         logger.error(f"Error deleting temp file {filename}: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to delete temp file: {str(e)}")
 
+def build_editor_page(filename: str, original_s3_path: str, document_key: str, document_url: str, user_id: str, username: str, readonly: bool) -> str:
+    """
+    Render the editor page for one document version and user.
+    
+    Pages are cached per (S3 path, document key, user, mode, document URL), so
+    repeat opens skip building the config, signing the JWT and rendering the template.
+    """
+    start = time.perf_counter()
+    cache_key = (original_s3_path, document_key, user_id, username, readonly, document_url)
+    html_content = editor_pages.get(cache_key)
+    if html_content is not None:
+        EDITOR_RENDER_SECONDS.labels("hit").observe(time.perf_counter() - start)
+        return html_content
+    
+    # Get file extension to determine document type
+    file_extension = get_file_extension(filename).lower()
+    
+    # Determine document type
+    if file_extension in ['.doc', '.docx', '.odt', '.txt', '.rtf']:
+        document_type = 'word'
+    elif file_extension in ['.xls', '.xlsx', '.ods', '.csv']:
+        document_type = 'cell'
+    elif file_extension in ['.ppt', '.pptx', '.odp']:
+        document_type = 'slide'
+    else:
+        document_type = 'word'  # Default
+    
+    # Callback URL for saving (use host.docker.internal for Docker container access)
+    callback_url = f"http://host.docker.internal:{settings.webhook_port}/webhook/callback"
+    
+    # Create ONLYOFFICE configuration object
+    config = {
+        "document": {
+            "fileType": file_extension.replace('.', ''),
+            "key": document_key,
+            "title": filename,
+            "url": document_url,
+            "permissions": {
+                "edit": not readonly,
+                "download": True,
+                "review": not readonly,
+                "fillForms": not readonly,
+                "comment": not readonly,
+                "copy": True,
+                "print": True,
+                "modifyFilter": not readonly,
+                "modifyContentControl": not readonly,
+                "protect": not readonly
+            }
+        },
+        "documentType": document_type,
+        "editorConfig": {
+            "mode": "view" if readonly else "edit",
+            "lang": "en",
+            "callbackUrl": callback_url,
+            "user": {
+                "id": user_id,
+                "name": username
+            },
+            "customization": {
+                "autosave": True,
+                "forcesave": True,
+                "chat": True,
+                "comments": True,
+                "help": True,
+                "hideRightMenu": False,
+                "review": True,
+                "toolbar": True,
+                "zoom": 100,
+                "compactToolbar": False,
+                "plugins": True,
+                "toolbarNoTabs": False,
+                "features": {
+                    "spellcheck": True,
+                    "grammarcheck": True
+                }
+            }
+        },
+        "width": "100%",
+        "height": "100%"
+    }
+    
+    # Generate JWT token if enabled
+    jwt_token = ""
+    if settings.jwt_enabled:
+        jwt_token = generate_jwt_token(config)
+        config["token"] = jwt_token
+    
+    # Convert config to JSON string for JavaScript
+    config_json = json.dumps(config, indent=2)
+    
+    html_content = EDITOR_PAGE_TEMPLATE.substitute(
+        filename=filename,
+        document_type_title=document_type.title(),
+        username=username,
+        user_id=user_id,
+        mode_label='📖 READ-ONLY' if readonly else '✏️ EDIT MODE',
+        document_key=document_key,
+        original_s3_path=original_s3_path,
+        readonly_banner=READONLY_BANNER if readonly else '',
+        host_ip=settings.host_ip,
+        webhook_port=settings.webhook_port,
+        onlyoffice_server_url=settings.onlyoffice_server_url,
+        document_url=document_url,
+        callback_url=callback_url,
+        jwt_enabled=str(settings.jwt_enabled).lower(),
+        config_json=config_json,
+        mode='readonly' if readonly else 'edit',
+    )
+    editor_pages.put(cache_key, original_s3_path, html_content)
+    EDITOR_RENDER_SECONDS.labels("miss").observe(time.perf_counter() - start)
+    return html_content
+
 @app.get("/editor/{filename}", response_class=HTMLResponse)
 async def document_editor(filename: str, request: Request):
     """Serve ONLYOFFICE document editor for a file"""
     try:
         # Find the original S3 path for this file
-        original_s3_path = await find_original_s3_path(filename)
+        s3_object = await resolve_s3_object(filename)
         
-        if not original_s3_path:
+        if not s3_object:
+            logger.error(f"File {filename} not found in any S3 location")
             raise HTTPException(status_code=404, detail=f"Document not found: {filename}")
         
-        # Generate consistent document key based on filename and S3 path (not random)
-        # This ensures all users editing the same document get the same key for collaboration
-        file_hash = hashlib.md5(f"{original_s3_path}".encode()).hexdigest()[:8]
-        
-        # Encode the S3 path in base64 to include in document key
-        encoded_s3_path = base64.b64encode(original_s3_path.encode()).decode()
-        
-        # Generate consistent document key for collaboration
-        # Format: doc_{hash}_{base64_s3_path}_{filename}
-        document_key = f"doc_{file_hash}_{encoded_s3_path}_{filename}"
-        
-        logger.info(f"Generated document key for {filename} from S3 path {original_s3_path}: {document_key}")
-        
-        # Get file extension to determine document type
-        file_extension = get_file_extension(filename).lower()
-        
-        # Determine document type
-        if file_extension in ['.doc', '.docx', '.odt', '.txt', '.rtf']:
-            document_type = 'word'
-        elif file_extension in ['.xls', '.xlsx', '.ods', '.csv']:
-            document_type = 'cell'
-        elif file_extension in ['.ppt', '.pptx', '.odp']:
-            document_type = 'slide'
-        else:
-            document_type = 'word'  # Default
+        # Protect the cached copy from eviction until ONLYOFFICE reports the session closed
+        temp_cache.pin(s3_object.key, settings.temp_cache_pin_hours * 3600)
         
         # Document download URL (via FastAPI proxy - accessible to ONLYOFFICE container)
         # Use host.docker.internal to allow Docker containers to access host services
         document_url = f"http://host.docker.internal:{settings.webhook_port}/download/{filename}"
-        
-        # Callback URL for saving (use host.docker.internal for Docker container access)
-        callback_url = f"http://host.docker.internal:{settings.webhook_port}/webhook/callback"
+        if settings.download_mode == "presigned":
+            # ONLYOFFICE fetches straight from S3; the S3 endpoint must be reachable from its container
+            document_url = await presigned_urls.get(s3_object.key)
         
         # Get user info from query parameters (for collaboration)
         user_id = request.query_params.get("user_id", "-1")
         username = request.query_params.get("username", "administrator")
         readonly = request.query_params.get("readonly", "false").lower() in ["true", "1", "yes"]
         
-        # Create ONLYOFFICE configuration object
-        config = {
-            "document": {
-                "fileType": file_extension.replace('.', ''),
-                "key": document_key,
-                "title": filename,
-                "url": document_url,
-                "permissions": {
-                    "edit": not readonly,
-                    "download": True,
-                    "review": not readonly,
-                    "fillForms": not readonly,
-                    "comment": not readonly,
-                    "copy": True,
-                    "print": True,
-                    "modifyFilter": not readonly,
-                    "modifyContentControl": not readonly,
-                    "protect": not readonly
-                }
-            },
-            "documentType": document_type,
-            "editorConfig": {
-                "mode": "view" if readonly else "edit",
-                "lang": "en",
-                "callbackUrl": callback_url,
-                "user": {
-                    "id": user_id,
-                    "name": username
-                },
-                "customization": {
-                    "autosave": True,
-                    "forcesave": True,
-                    "chat": True,
-                    "comments": True,
-                    "help": True,
-                    "hideRightMenu": False,
-                    "review": True,
-                    "toolbar": True,
-                    "zoom": 100,
-                    "compactToolbar": False,
-                    "plugins": True,
-                    "toolbarNoTabs": False,
-                    "features": {
-                        "spellcheck": True,
-                        "grammarcheck": True
-                    }
-                }
-            },
-            "width": "100%",
-            "height": "100%"
-        }
-        
-        # Generate JWT token if enabled
-        jwt_token = ""
-        if settings.jwt_enabled:
-            jwt_token = generate_jwt_token(config)
-            config["token"] = jwt_token
-        
-        # Convert config to JSON string for JavaScript
-        config_json = json.dumps(config, indent=2)
-        
-        # Create HTML page with ONLYOFFICE editor
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <title>Edit {filename} - ONLYOFFICE</title>
-            <style>
-                html, body {{
-                    margin: 0;
-                    padding: 0;
-                    height: 100%;
-                    font-family: Arial, sans-serif;
-                    background-color: #f5f5f5;
-                }}
-                .container {{
-                    display: flex;
-                    flex-direction: column;
-                    height: 100vh;
-                    padding: 10px;
-                    box-sizing: border-box;
-                }}
-                .header {{
-                    background: white;
-                    padding: 15px;
-                    border-radius: 8px;
-                    box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-                    margin-bottom: 10px;
-                    flex-shrink: 0;
-                }}
-                .editor-container {{
-                    background: white;
-                    border-radius: 8px;
-                    box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-                    overflow: hidden;
-                    flex: 1;
-                    display: flex;
-                    flex-direction: column;
-                }}
-                #editor {{
-                    width: 100%;
-                    height: 100%;
-                    min-height: 500px;
-                    border: none;
-                }}
-                .info {{
-                    display: flex;
-                    justify-content: space-between;
-                    align-items: center;
-                }}
-                .back-link {{
-                    background: #007bff;
-                    color: white;
-                    padding: 8px 16px;
-                    text-decoration: none;
-                    border-radius: 4px;
-                }}
-                .back-link:hover {{
-                    background: #0056b3;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <div class="info">
-                        <div>
-                            <h2>📄 {filename}</h2>
-                            <p><strong>Document Type:</strong> {document_type.title()}</p>
-                            <p><strong>Current User:</strong> {username} (ID: {user_id}) {'📖 READ-ONLY' if readonly else '✏️ EDIT MODE'}</p>
-                            <p><strong>Document Key:</strong> <code>{document_key}</code></p>
-                            <p><strong>Original S3 Path:</strong> <code>{original_s3_path}</code></p>
-                            <p><small>Changes will be saved back to the original location</small></p>
-                            <p><small>💡 <strong>Real-time Collaboration:</strong> Open this same URL in another window with different users to test collaboration!</small></p>
-                            {'<p style="background-color: #fff3cd; color: #856404; padding: 10px; border-radius: 4px; margin-top: 10px;"><strong>📖 READ-ONLY MODE:</strong> You can view this document but cannot make changes.</p>' if readonly else ''}
-                        </div>
-                        <a href="http://{settings.host_ip}:{settings.webhook_port}/" class="back-link">← Back to API</a>
-                    </div>
-                </div>
-                
-                <div class="editor-container">
-                    <div id="editor"></div>
-                </div>
-            </div>
-
-            <script src="{settings.onlyoffice_server_url}/web-apps/apps/api/documents/api.js"></script>
-            <script>
-                window.onload = function() {{
-                    console.log('Initializing ONLYOFFICE editor...');
-                    console.log('Document URL:', '{document_url}');
-                    console.log('Callback URL:', '{callback_url}');
-                    console.log('JWT Enabled:', {str(settings.jwt_enabled).lower()});
-                    
-                    // ONLYOFFICE configuration with JWT token
-                    var config = {config_json};
-                    
-                    // Add event handlers for collaboration
-                    config.events = {{
-                        "onReady": function() {{
-                            console.log("Document editor ready for user: {username} ({'readonly' if readonly else 'edit'} mode)");
-                        }},
-                        "onError": function(event) {{
-                            console.error("Editor error:", event);
-                            alert("Error loading document: " + JSON.stringify(event));
-                        }},
-                        "onDocumentStateChange": function(event) {{
-                            console.log("Document state changed:", event);
-                        }},
-                        "onInfo": function(event) {{
-                            console.log("Editor info:", event);
-                        }},
-                        "onWarning": function(event) {{
-                            console.warn("Editor warning:", event);
-                        }},
-                        "onRequestUsers": function(event) {{
-                            console.log("Users requested:", event);
-                        }},
-                        "onRequestSendNotify": function(event) {{
-                            console.log("Send notify requested:", event);
-                        }},
-                        "onCollaborativeChanges": function() {{
-                            console.log("Collaborative changes detected");
-                        }}
-                    }};
-                    
-                    console.log('ONLYOFFICE config:', config);
-                    
-                    var docEditor = new DocsAPI.DocEditor("editor", config);
-                }};
-            </script>
-        </body>
-        </html>
-        """
+        # All users editing the same version get the same key for collaboration; an open session keeps
+        # its key across force saves, otherwise the key follows the ETag so ONLYOFFICE reconverts only changed files
+        document_key = await session_key_for(s3_object.key)
+        if not document_key:
+            # An object replaced outside this server must not reopen under its old key and cached conversion
+            s3_object = await confirm_s3_object(s3_object)
+            if not s3_object:
+                raise HTTPException(status_code=404, detail=f"Document not found: {filename}")
+            document_key = await issue_document_key(s3_object.key, s3_object.etag)
+        logger.info(f"Using document key for {filename} from S3 path {s3_object.key}: {document_key}")
         
+        html_content = build_editor_page(filename, s3_object.key, document_key, document_url, user_id, username, readonly)
         return HTMLResponse(content=html_content)
         
     except Exception as e:
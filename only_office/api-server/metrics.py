@@ -0,0 +1,122 @@
+"""
+Prometheus metrics for the ONLYOFFICE API server
+Request, S3, temp cache, disk and save-path instrumentation, exported on /metrics
+"""
+
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Latency buckets from sub-millisecond cache hits up to multi-minute transfers
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = tuple(2 ** n * 1024 for n in range(0, 22, 2))  # 1 KiB .. 2 GiB
+
+REQUEST_LATENCY = Histogram(
+    "onlyoffice_http_request_duration_seconds",
+    "Time from request start until the last response byte was sent",
+    ["route", "method", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+S3_OPERATION_LATENCY = Histogram(
+    "onlyoffice_s3_operation_duration_seconds",
+    "Duration of S3 calls, excluding time spent waiting for a concurrency slot",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+S3_OPERATION_ERRORS = Counter(
+    "onlyoffice_s3_operation_errors_total",
+    "Failed S3 calls by operation and error code (NoSuchKey is expected while probing paths)",
+    ["operation", "code"],
+)
+S3_SLOT_WAIT = Histogram(
+    "onlyoffice_s3_slot_wait_seconds",
+    "Time S3 calls waited for a free metadata or transfer slot",
+    ["pool"],
+    buckets=LATENCY_BUCKETS,
+)
+S3_DOWNLOADED_BYTES = Counter("onlyoffice_s3_downloaded_bytes_total", "Object bytes read from S3")
+
+DISK_WRITE_SECONDS = Counter(
+    "onlyoffice_temp_cache_disk_write_seconds_total",
+    "Time spent writing downloaded objects to TEMP_DIR (part of the get_object duration)",
+)
+
+TEMP_CACHE_REQUESTS = Counter(
+    "onlyoffice_temp_cache_requests_total",
+    "Temp cache lookups by outcome: hit, revalidated, peer or miss",
+    ["result"],
+)
+TEMP_CACHE_REMOVALS = Counter(
+    "onlyoffice_temp_cache_removals_total",
+    "Files removed from the temp cache, by reason (budget eviction or TTL expiry)",
+    ["reason"],
+)
+TEMP_CACHE_BYTES = Gauge("onlyoffice_temp_cache_bytes", "Bytes of cached files in TEMP_DIR")
+TEMP_CACHE_MEMORY_BYTES = Gauge("onlyoffice_temp_cache_memory_bytes", "Bytes of cached files held in the RAM tier")
+TEMP_CACHE_MEMORY_EVENTS = Counter(
+    "onlyoffice_temp_cache_memory_events_total",
+    "RAM tier activity: hit (served from memory), promotion or demotion",
+    ["event"],
+)
+TEMP_CACHE_FILES = Gauge("onlyoffice_temp_cache_files", "Cached files in TEMP_DIR")
+
+EDITOR_RENDER_SECONDS = Histogram(
+    "onlyoffice_editor_render_seconds",
+    "CPU-bound time to produce an editor page, by page cache outcome",
+    ["cache"],
+    buckets=LATENCY_BUCKETS,
+)
+
+SAVE_DURATION = Histogram(
+    "onlyoffice_save_duration_seconds",
+    "Duration of callback saves from ONLYOFFICE to S3",
+    ["result"],
+    buckets=LATENCY_BUCKETS,
+)
+SAVE_QUEUE_DEPTH = Gauge("onlyoffice_save_queue_depth", "Documents waiting for or undergoing a save")
+SAVED_DOCUMENT_BYTES = Histogram(
+    "onlyoffice_saved_document_bytes",
+    "Size of documents downloaded from ONLYOFFICE on save",
+    buckets=SIZE_BUCKETS,
+)
+SERVED_DOCUMENT_BYTES = Histogram(
+    "onlyoffice_download_document_bytes",
+    "Size of documents served by /download",
+    buckets=SIZE_BUCKETS,
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording per-route request latency.
+
+    Timing ends when the last body chunk has been sent, so streamed and file
+    responses are measured in full. Routes are labelled by their path
+    template, which keeps label cardinality bounded.
+    """
+
+    def __init__(self, app, excluded_paths=("/metrics",)):
+        self.app = app
+        self.excluded_paths = set(excluded_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(
+                getattr(route, "path", "unmatched"), scope["method"], str(status[0])
+            ).observe(time.perf_counter() - start)
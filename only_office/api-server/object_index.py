@@ -0,0 +1,241 @@
+"""
+In-process S3 object index
+Resolves a bare filename to its object key, size and ETag without probing S3 for every candidate path,
+and serves bucket listings from memory between incremental refreshes
+"""
+
+import asyncio
+import bisect
+import logging
+import math
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Locations checked for a bare filename, in priority order
+S3_PATH_PREFIXES = ("uploads/", "", "documents/")
+
+
+def candidate_keys(filename: str) -> List[str]:
+    """Return the S3 keys a bare filename may be stored under, in priority order"""
+    return [f"{prefix}{filename}" for prefix in S3_PATH_PREFIXES]
+
+
+class IndexedObject(NamedTuple):
+    """Metadata kept in the index for a single S3 object"""
+    key: str
+    size: int
+    etag: Optional[str]
+    last_modified: Optional[datetime]
+    indexed_at: float = 0.0  # time.monotonic() when this entry was written or listed
+
+
+class ObjectIndex:
+    """
+    Map of S3 key -> object metadata, built from a list_objects scan.
+
+    A filename resolves by checking its candidate keys in priority order,
+    which is a handful of dict lookups instead of serial stat_object calls.
+    Keys are also kept sorted so listings can be paged from memory.
+    """
+
+    def __init__(self):
+        self._objects: Dict[str, IndexedObject] = {}
+        self._keys: List[str] = []
+        self.loaded = False
+        self.loaded_at: Optional[datetime] = None
+        self._refreshed_at: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._objects)
+
+    def __iter__(self) -> Iterator[IndexedObject]:
+        return iter(list(self._objects.values()))
+
+    def load(self, objects, listed_at: float) -> None:
+        """
+        Replace the index contents with a full S3 listing started at listed_at.
+
+        Entries written after the listing started are kept, as in
+        replace_range, so uploads and saves made while it ran are not lost.
+        """
+        fresh: Dict[str, IndexedObject] = {}
+        for obj in objects:
+            if getattr(obj, "is_dir", False):
+                continue
+            fresh[obj.object_name] = IndexedObject(
+                obj.object_name, obj.size or 0, obj.etag, obj.last_modified, listed_at
+            )
+        for key, entry in self._objects.items():
+            if entry.indexed_at >= listed_at:
+                fresh[key] = entry
+        self._objects = fresh
+        self._keys = sorted(fresh)
+        self.loaded = True
+        self.loaded_at = datetime.now()
+        self._refreshed_at = listed_at
+        logger.info(f"Object index loaded with {len(fresh)} entries")
+
+    def get(self, key: str) -> Optional[IndexedObject]:
+        return self._objects.get(key)
+
+    def put(self, key: str, size: int, etag: Optional[str], last_modified: Optional[datetime] = None) -> IndexedObject:
+        """Record a written or probed object; last_modified is kept as an aware UTC time like S3 listings"""
+        last_modified = last_modified.astimezone(timezone.utc) if last_modified else datetime.now(timezone.utc)
+        entry = IndexedObject(key, size, etag, last_modified, time.monotonic())
+        if key not in self._objects:
+            bisect.insort(self._keys, key)
+        self._objects[key] = entry
+        return entry
+
+    def remove(self, key: str) -> None:
+        if self._objects.pop(key, None) is not None:
+            i = bisect.bisect_left(self._keys, key)
+            if i < len(self._keys) and self._keys[i] == key:
+                del self._keys[i]
+
+    def lookup(self, filename: str) -> Optional[IndexedObject]:
+        """Resolve a bare filename from memory; None means the caller must probe S3"""
+        for key in candidate_keys(filename):
+            entry = self._objects.get(key)
+            if entry is not None:
+                return entry
+        return None
+
+    def is_fresh(self, ttl_seconds: float) -> bool:
+        """True when the whole bucket was listed within ttl_seconds"""
+        return self._refreshed_at is not None and time.monotonic() - self._refreshed_at < ttl_seconds
+
+    def mark_refreshed(self, listed_at: Optional[float] = None) -> None:
+        """Record a completed full listing; listed_at is when its oldest page was read"""
+        self.loaded = True
+        self.loaded_at = datetime.now()
+        self._refreshed_at = listed_at if listed_at is not None else time.monotonic()
+
+    def page(self, prefix: Optional[str] = None, start_after: Optional[str] = None, limit: int = 1000) -> List[IndexedObject]:
+        """Objects in key order, like an S3 LIST with prefix and start_after"""
+        prefix = prefix or ""
+        start = max(start_after or "", prefix)
+        if start_after is not None and start == start_after:
+            i = bisect.bisect_right(self._keys, start)
+        else:
+            i = bisect.bisect_left(self._keys, start)
+        result = []
+        while i < len(self._keys) and len(result) < limit:
+            key = self._keys[i]
+            if not key.startswith(prefix):
+                break
+            result.append(self._objects[key])
+            i += 1
+        return result
+
+    def replace_range(self, objects, after: Optional[str], through: Optional[str], listed_at: float) -> None:
+        """
+        Make keys in (after, through] match a fresh listing of that range.
+
+        through=None means the range runs to the end of the bucket. Entries
+        written after the listing was taken are kept, so a concurrent upload
+        is never dropped by a refresh that did not see it.
+        """
+        lo = bisect.bisect_right(self._keys, after) if after is not None else 0
+        hi = bisect.bisect_right(self._keys, through) if through is not None else len(self._keys)
+        listed = {obj.object_name for obj in objects}
+        for key in self._keys[lo:hi]:
+            if key not in listed and self._objects[key].indexed_at < listed_at:
+                self.remove(key)
+        for obj in objects:
+            current = self._objects.get(obj.object_name)
+            if current is not None and current.indexed_at >= listed_at:
+                continue
+            if current is None:
+                bisect.insort(self._keys, obj.object_name)
+            self._objects[obj.object_name] = IndexedObject(
+                obj.object_name, obj.size or 0, obj.etag, obj.last_modified, listed_at
+            )
+
+
+class IndexRefresher:
+    """
+    Rolling background refresh of the object index.
+
+    Each tick re-lists a few S3 pages, continuing where the previous tick
+    stopped, so the LIST cost of a full sweep is spread out over time.
+
+    With sweep_seconds set, a tick lists more than pages_per_tick pages when
+    the bucket is too large for a sweep at that rate to finish in time, so
+    the index keeps counting as fresh however many objects it holds.
+    """
+
+    def __init__(
+        self,
+        index: ObjectIndex,
+        storage,
+        interval_seconds: float,
+        pages_per_tick: int = 10,
+        page_size: int = 1000,
+        sweep_seconds: Optional[float] = None,
+    ):
+        self.index = index
+        self.storage = storage
+        self.interval_seconds = interval_seconds
+        self.pages_per_tick = pages_per_tick
+        self.page_size = page_size
+        self.sweep_seconds = sweep_seconds
+        self._cursor: Optional[str] = None
+        self._sweep_started: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pages_for_tick(self) -> int:
+        """Pages to list per tick so a full sweep takes at most sweep_seconds"""
+        if not self.sweep_seconds or self.interval_seconds <= 0:
+            return self.pages_per_tick
+        ticks = max(1, int(self.sweep_seconds // self.interval_seconds))
+        bucket_pages = math.ceil(len(self.index) / self.page_size) + 1
+        return max(self.pages_per_tick, math.ceil(bucket_pages / ticks))
+
+    async def step(self) -> None:
+        """Refresh the next pages_for_tick pages of the listing"""
+        cursor = self._cursor
+        if cursor is None:
+            self._sweep_started = time.monotonic()
+        pages_for_tick = self.pages_for_tick
+        pages = 0
+        async for batch in self.storage.iter_objects(start_after=cursor, batch_size=self.page_size):
+            listed_at = time.monotonic()
+            through = batch[-1].object_name
+            self.index.replace_range(batch, cursor, through, listed_at)
+            cursor = through
+            pages += 1
+            if len(batch) == self.page_size and pages >= pages_for_tick:
+                self._cursor = cursor
+                return
+
+        # Reached the end of the bucket: drop anything indexed after the last listed key
+        self.index.replace_range([], cursor, None, time.monotonic())
+        self._cursor = None
+        # The sweep is only as fresh as its first page
+        self.index.mark_refreshed(self._sweep_started)
+
+    async def _run_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.step()
+            except Exception as e:
+                logger.error(f"Object index refresh failed: {e}")
+
+    def start(self) -> None:
+        if self._task is None and self.interval_seconds > 0:
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,155 @@
+"""
+Peer-to-peer temp cache fill
+Assigns every S3 object to an owning replica by consistent hashing and pulls cached copies from the owner before S3
+"""
+
+import bisect
+import hashlib
+import hmac
+import logging
+import time
+from pathlib import Path
+from typing import Callable, List, NamedTuple, Optional
+from urllib.parse import quote
+
+import aiofiles
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Sent on peer requests, so the receiving replica never forwards them to yet another peer
+PEER_REQUEST_HEADER = "X-Peer-Fetch"
+S3_KEY_HEADER = "X-S3-Key"
+# "<unix time>:<HMAC-SHA256 hex>" over the requesting replica, the S3 key and the time, keyed by the shared secret
+PEER_SIGNATURE_HEADER = "X-Peer-Signature"
+MAX_SIGNATURE_AGE_SECONDS = 300
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+def _signature(secret: str, peer: str, s3_key: str, timestamp: str) -> str:
+    message = f"{peer}\n{s3_key}\n{timestamp}".encode()
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+class HashRing:
+    """
+    Consistent hash ring over replica URLs.
+
+    Each replica gets virtual_nodes points on the ring, so documents spread
+    evenly and adding or removing a replica only moves the documents it owns.
+    """
+
+    def __init__(self, nodes: List[str], virtual_nodes: int = 100):
+        self.nodes = list(nodes)
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(virtual_nodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._hashes:
+            return None
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[i]
+
+
+class PeerCopy(NamedTuple):
+    """A cached file received from the owning replica"""
+    s3_key: str
+    etag: Optional[str]
+    size: int
+    peer: str
+    content_hash: str  # Hex SHA-256, taken while the copy was written
+
+
+class PeerFetcher:
+    """Fetches documents this replica does not own from the replica that does"""
+
+    def __init__(self, ring: HashRing, self_url: str, secret: str, client: Callable[[], httpx.AsyncClient], timeout_seconds: float):
+        self.ring = ring
+        self.self_url = self_url
+        self._secret = secret
+        self._client = client
+        self.timeout_seconds = timeout_seconds
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        if self_url not in ring.nodes:
+            logger.warning(f"Peer URL {self_url!r} is not in the peer list; every document will be fetched from peers")
+
+    def owner_of(self, s3_key: str) -> Optional[str]:
+        """The replica owning an object, or None when it is this one"""
+        owner = self.ring.owner(s3_key)
+        return None if owner == self.self_url else owner
+
+    def sign(self, s3_key: str) -> str:
+        """Signature header value for a request from this replica"""
+        timestamp = str(int(time.time()))
+        return f"{timestamp}:{_signature(self._secret, self.self_url, s3_key, timestamp)}"
+
+    def verify(self, peer: str, s3_key: str, signature: str) -> bool:
+        """True for a recent request signed with the shared secret by another replica in the ring"""
+        if peer not in self.ring.nodes or peer == self.self_url:
+            return False
+        timestamp, _, digest = signature.partition(":")
+        try:
+            if abs(time.time() - int(timestamp)) > MAX_SIGNATURE_AGE_SECONDS:
+                return False
+        except ValueError:
+            return False
+        return hmac.compare_digest(digest, _signature(self._secret, peer, s3_key, timestamp))
+
+    async def fetch(self, s3_key: str, dest: Path, expected_etag: Optional[str] = None) -> Optional[PeerCopy]:
+        """
+        Download the owner's cached copy into dest.
+
+        The owner fills its cache from S3 on a miss, so a document is pulled
+        from S3 once per cluster. Returns None when the caller should go to S3
+        itself: this replica owns the document, the peer does not have it,
+        or the peer is unreachable.
+        """
+        peer = self.owner_of(s3_key)
+        if peer is None:
+            return None
+
+        url = f"{peer}/peer/objects/{quote(s3_key)}"
+        params = {"etag": expected_etag} if expected_etag else None
+        try:
+            async with self._client().stream(
+                "GET", url, params=params, headers={PEER_REQUEST_HEADER: self.self_url, PEER_SIGNATURE_HEADER: self.sign(s3_key)}, timeout=self.timeout_seconds
+            ) as response:
+                if response.status_code != 200 or S3_KEY_HEADER not in response.headers:
+                    self.misses += 1
+                    logger.info(f"Peer {peer} has no copy of {s3_key} (HTTP {response.status_code})")
+                    return None
+                size = 0
+                digest = hashlib.sha256()
+                async with aiofiles.open(dest, "wb") as f:
+                    async for chunk in response.aiter_bytes(256 * 1024):
+                        await f.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+                expected_size = response.headers.get("Content-Length")
+                if expected_size is not None and int(expected_size) != size:
+                    raise ValueError(f"received {size} of {expected_size} bytes")
+                etag = (response.headers.get("ETag") or "").replace('"', "") or None
+                copy = PeerCopy(response.headers[S3_KEY_HEADER], etag, size, peer, digest.hexdigest())
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Peer fetch of {s3_key} from {peer} failed, falling back to S3: {e}")
+            return None
+
+        self.hits += 1
+        logger.info(f"Fetched {s3_key} ({size} bytes) from peer {peer}")
+        return copy
+
+    def stats(self) -> dict:
+        return {
+            "self": self.self_url,
+            "peers": self.ring.nodes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+        }
@@ -0,0 +1,540 @@
+"""
+Durable callback save queue
+Coalesces ONLYOFFICE save callbacks per document key, runs them on a bounded worker pool and retries failures.
+The stores also keep the S3 paths behind hashed document keys, so replayed saves can always be resolved
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from metrics import SAVE_DURATION
+
+logger = logging.getLogger(__name__)
+
+
+class SaveJob:
+    """The newest pending save for one document key"""
+
+    __slots__ = ("document_key", "url", "enqueued_at", "attempts")
+
+    def __init__(self, document_key: str, url: str, enqueued_at: Optional[float] = None, attempts: int = 0):
+        self.document_key = document_key
+        self.url = url
+        self.enqueued_at = enqueued_at or time.time()
+        self.attempts = attempts
+
+
+class MemorySaveStore:
+    """Non-durable store; pending saves are lost on restart"""
+
+    def __init__(self):
+        self._key_paths: Dict[str, str] = {}
+
+    async def put_key_path(self, digest: str, s3_path: str) -> None:
+        self._key_paths[digest] = s3_path
+
+    async def get_key_path(self, digest: str) -> Optional[str]:
+        return self._key_paths.get(digest)
+
+    async def put(self, job: SaveJob) -> None:
+        pass
+
+    async def remove(self, document_key: str, url: str) -> None:
+        pass
+
+    # Only one process ever reads the store, so there is nothing to claim
+    lease_seconds: Optional[float] = None
+
+    async def load(self) -> List[SaveJob]:
+        return []
+
+    async def acquire(self, job: SaveJob) -> str:
+        return "ok"
+
+    async def release(self, document_key: str) -> None:
+        pass
+
+    async def renew(self, document_keys: List[str]) -> List[str]:
+        return []
+
+    async def close(self) -> None:
+        pass
+
+
+class SQLiteSaveStore:
+    """Pending saves in a local SQLite database, one row per document key"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS save_jobs ("
+            "document_key TEXT PRIMARY KEY, url TEXT NOT NULL, enqueued_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS key_paths (digest TEXT PRIMARY KEY, s3_path TEXT NOT NULL)")
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    async def put(self, job: SaveJob) -> None:
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT OR REPLACE INTO save_jobs (document_key, url, enqueued_at) VALUES (?, ?, ?)",
+            (job.document_key, job.url, job.enqueued_at),
+        )
+
+    async def put_key_path(self, digest: str, s3_path: str) -> None:
+        await asyncio.to_thread(
+            self._execute, "INSERT OR REPLACE INTO key_paths (digest, s3_path) VALUES (?, ?)", (digest, s3_path)
+        )
+
+    async def get_key_path(self, digest: str) -> Optional[str]:
+        rows = await asyncio.to_thread(self._execute, "SELECT s3_path FROM key_paths WHERE digest = ?", (digest,))
+        return rows[0][0] if rows else None
+
+    async def remove(self, document_key: str, url: str) -> None:
+        # Only remove the row if no newer save replaced it in the meantime
+        await asyncio.to_thread(
+            self._execute,
+            "DELETE FROM save_jobs WHERE document_key = ? AND url = ?",
+            (document_key, url),
+        )
+
+    async def load(self) -> List[SaveJob]:
+        rows = await asyncio.to_thread(
+            self._execute, "SELECT document_key, url, enqueued_at FROM save_jobs ORDER BY enqueued_at"
+        )
+        return [SaveJob(key, url, enqueued_at) for key, url, enqueued_at in rows]
+
+    # The database file is local to one instance
+    lease_seconds: Optional[float] = None
+
+    async def acquire(self, job: SaveJob) -> str:
+        return "ok"
+
+    async def release(self, document_key: str) -> None:
+        pass
+
+    async def renew(self, document_keys: List[str]) -> List[str]:
+        return []
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# Claims every pending save that no live instance owns; returns [key, value, ...]
+_CLAIM_SCRIPT = """
+local claimed = {}
+local jobs = redis.call('HGETALL', KEYS[1])
+for i = 1, #jobs, 2 do
+    if redis.call('SET', ARGV[1] .. jobs[i], ARGV[2], 'NX', 'PX', ARGV[3]) then
+        table.insert(claimed, jobs[i])
+        table.insert(claimed, jobs[i + 1])
+    end
+end
+return claimed
+"""
+
+# Extends this instance's ownership and run locks; returns the keys another instance has taken over
+_RENEW_SCRIPT = """
+local lost = {}
+for i = 3, #ARGV do
+    local key = ARGV[i]
+    local owner = redis.call('GET', KEYS[2] .. key)
+    if owner == ARGV[1] then
+        redis.call('PEXPIRE', KEYS[2] .. key, ARGV[2])
+    elseif owner then
+        table.insert(lost, key)
+    elseif redis.call('HEXISTS', KEYS[1], key) == 1 then
+        redis.call('SET', KEYS[2] .. key, ARGV[1], 'PX', ARGV[2])
+    end
+    if redis.call('GET', KEYS[3] .. key) == ARGV[1] then
+        redis.call('PEXPIRE', KEYS[3] .. key, ARGV[2])
+    end
+end
+return lost
+"""
+
+# Takes the run lock for one document unless a newer save or another running instance owns it
+_ACQUIRE_SCRIPT = """
+local owner = redis.call('GET', KEYS[2])
+if owner and owner ~= ARGV[1] then
+    return 'superseded'
+end
+local raw = redis.call('HGET', KEYS[1], ARGV[3])
+if raw and cjson.decode(raw)['url'] ~= ARGV[4] then
+    return 'superseded'
+end
+local holder = redis.call('GET', KEYS[3])
+if holder and holder ~= ARGV[1] then
+    return 'busy'
+end
+redis.call('SET', KEYS[3], ARGV[1], 'PX', ARGV[2])
+redis.call('SET', KEYS[2], ARGV[1], 'PX', ARGV[2])
+return 'ok'
+"""
+
+# Deletes the job only if it is still the given URL, so a newer save is kept
+_REMOVE_SCRIPT = """
+local raw = redis.call('HGET', KEYS[1], ARGV[1])
+if raw and cjson.decode(raw)['url'] == ARGV[2] then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+end
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+end
+"""
+
+
+class RedisSaveStore:
+    """
+    Pending saves in a Redis hash keyed by document key, shared by all replicas.
+
+    Each pending save is owned by one instance through an expiring owner key:
+    the instance that receives a callback takes ownership, keeps it alive with
+    renew() while the save is pending, and other instances only claim saves
+    whose owner has stopped renewing (crashed or shut down). A per-document
+    run lock keeps two instances from saving the same document at once, and
+    an instance drops its save when a newer callback was stored by another one.
+    Owner keys are left to expire after a save, so a replica still holding an
+    older URL sees the newer owner on its next renew.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        db: int = 0,
+        lease_seconds: float = 30.0,
+        hash_key: str = "onlyoffice:save_jobs",
+        instance_id: Optional[str] = None,
+    ):
+        import redis.asyncio as aioredis
+
+        self._redis = aioredis.Redis(host=host, port=port, db=db)
+        self._hash_key = hash_key
+        self._key_paths_key = f"{hash_key}:key_paths"
+        self._owner_prefix = f"{hash_key}:owner:"
+        self._lock_prefix = f"{hash_key}:lock:"
+        self.lease_seconds = lease_seconds
+        self.instance_id = instance_id or uuid.uuid4().hex
+        self._claim = self._redis.register_script(_CLAIM_SCRIPT)
+        self._renew = self._redis.register_script(_RENEW_SCRIPT)
+        self._acquire = self._redis.register_script(_ACQUIRE_SCRIPT)
+        self._remove = self._redis.register_script(_REMOVE_SCRIPT)
+        self._release = self._redis.register_script(_RELEASE_SCRIPT)
+
+    @property
+    def _lease_ms(self) -> int:
+        return int(self.lease_seconds * 1000)
+
+    async def put(self, job: SaveJob) -> None:
+        value = json.dumps({"url": job.url, "enqueued_at": job.enqueued_at})
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._hash_key, job.document_key, value)
+            # The newest callback wins: an older copy on another replica is dropped when it next checks
+            pipe.set(self._owner_prefix + job.document_key, self.instance_id, px=self._lease_ms)
+            await pipe.execute()
+
+    async def put_key_path(self, digest: str, s3_path: str) -> None:
+        await self._redis.hset(self._key_paths_key, digest, s3_path)
+
+    async def get_key_path(self, digest: str) -> Optional[str]:
+        raw = await self._redis.hget(self._key_paths_key, digest)
+        return raw.decode() if raw else None
+
+    async def remove(self, document_key: str, url: str) -> None:
+        await self._remove(keys=[self._hash_key], args=[document_key, url])
+
+    async def load(self) -> List[SaveJob]:
+        """Claim and return the pending saves no live instance owns"""
+        claimed = await self._claim(keys=[self._hash_key], args=[self._owner_prefix, self.instance_id, self._lease_ms])
+        jobs = []
+        for key, raw in zip(claimed[::2], claimed[1::2]):
+            data = json.loads(raw)
+            jobs.append(SaveJob(key.decode(), data["url"], data["enqueued_at"]))
+        return sorted(jobs, key=lambda job: job.enqueued_at)
+
+    async def acquire(self, job: SaveJob) -> str:
+        """ok to run the save, busy if another instance is saving the document, superseded if a newer save exists"""
+        result = await self._acquire(
+            keys=[self._hash_key, self._owner_prefix + job.document_key, self._lock_prefix + job.document_key],
+            args=[self.instance_id, self._lease_ms, job.document_key, job.url],
+        )
+        return result.decode()
+
+    async def release(self, document_key: str) -> None:
+        await self._release(keys=[self._lock_prefix + document_key], args=[self.instance_id])
+
+    async def renew(self, document_keys: List[str]) -> List[str]:
+        """Extend leases on this instance's saves; returns the keys now owned by another instance"""
+        if not document_keys:
+            return []
+        lost = await self._renew(
+            keys=[self._hash_key, self._owner_prefix, self._lock_prefix],
+            args=[self.instance_id, self._lease_ms, *document_keys],
+        )
+        return [key.decode() for key in lost]
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+def create_save_store(
+    backend: str, sqlite_path: str, redis_host: str, redis_port: int, redis_db: int, lease_seconds: float = 30.0
+):
+    """Build the persistence backend named in settings"""
+    if backend == "sqlite":
+        return SQLiteSaveStore(sqlite_path)
+    if backend == "redis":
+        return RedisSaveStore(redis_host, redis_port, redis_db, lease_seconds)
+    if backend == "memory":
+        return MemorySaveStore()
+    raise ValueError(f"Unknown save queue backend: {backend}")
+
+
+class SaveQueue:
+    """
+    Per-document save queue.
+
+    Only the newest callback URL for a document key is kept: a save that
+    arrives while an older one is queued replaces it, and one that arrives
+    while a save is running is picked up as soon as that save finishes.
+    A failed save is retried with exponential backoff up to max_attempts.
+    With a shared store, the queue keeps its saves leased, adopts saves left
+    behind by instances that stopped, and defers to the store before each run.
+    """
+
+    def __init__(
+        self,
+        save_func: Callable[[str, str], Awaitable[bool]],
+        store,
+        workers: int = 4,
+        max_attempts: int = 5,
+        retry_base_seconds: float = 2.0,
+        retry_max_seconds: float = 60.0,
+    ):
+        self._save_func = save_func
+        self._store = store
+        self._workers_count = workers
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self._pending: Dict[str, SaveJob] = {}
+        self._queued: Set[str] = set()
+        self._running: Set[str] = set()
+        self._ready: "asyncio.Queue[str]" = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+        self._lease_task: Optional[asyncio.Task] = None
+        self._retry_handles: Dict[str, asyncio.TimerHandle] = {}
+        self._latencies: Deque[float] = deque(maxlen=200)
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.coalesced = 0
+
+    @property
+    def depth(self) -> int:
+        """Documents waiting for or undergoing a save"""
+        return len(self._pending)
+
+    async def start(self) -> None:
+        for job in await self._store.load():
+            self._pending[job.document_key] = job
+            self._schedule(job.document_key)
+        if self._pending:
+            logger.info(f"Restored {len(self._pending)} pending document saves")
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self._workers_count)]
+        if self._store.lease_seconds:
+            self._lease_task = asyncio.create_task(self._lease_loop(self._store.lease_seconds / 3))
+
+    async def _lease_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                for document_key in await self._store.renew(list(self._pending)):
+                    # Another instance took a newer callback for this document
+                    if document_key not in self._running:
+                        self._drop(document_key)
+                adopted = 0
+                for job in await self._store.load():
+                    if job.document_key not in self._pending:
+                        self._pending[job.document_key] = job
+                        self._schedule(job.document_key)
+                        adopted += 1
+                if adopted:
+                    logger.info(f"Adopted {adopted} pending saves from stopped instances")
+            except Exception as e:
+                logger.error(f"Save queue lease renewal failed: {e}")
+
+    def _drop(self, document_key: str) -> None:
+        self._pending.pop(document_key, None)
+        handle = self._retry_handles.pop(document_key, None)
+        if handle:
+            handle.cancel()
+
+    async def enqueue(self, document_key: str, url: str) -> None:
+        """Queue a save; replaces any not-yet-started save of the same document"""
+        job = SaveJob(document_key, url)
+        if document_key in self._pending:
+            self.coalesced += 1
+        self._pending[document_key] = job
+        try:
+            await self._store.put(job)
+        except Exception as e:
+            # The save still runs; it just would not survive a restart
+            logger.error(f"Could not persist save of {document_key}: {e}")
+        # A retry wait is pointless once a newer URL is available
+        handle = self._retry_handles.pop(document_key, None)
+        if handle:
+            handle.cancel()
+        self._schedule(document_key)
+
+    def _schedule(self, document_key: str) -> None:
+        if document_key not in self._queued and document_key not in self._running:
+            self._queued.add(document_key)
+            self._ready.put_nowait(document_key)
+
+    async def _worker(self) -> None:
+        while True:
+            document_key = await self._ready.get()
+            self._queued.discard(document_key)
+            try:
+                await self._run_job(document_key)
+            except Exception as e:
+                # Workers must outlive any single job, or saves would silently stop
+                logger.error(f"Save queue worker error for {document_key}: {e}")
+
+    async def _run_job(self, document_key: str) -> None:
+        job = self._pending.get(document_key)
+        if job is None:
+            return
+        self._running.add(document_key)
+        try:
+            claim = await self._store.acquire(job)
+        except Exception as e:
+            # Better a possibly duplicate save than a lost one
+            logger.error(f"Could not claim save of {document_key}, saving anyway: {e}")
+            claim = "ok"
+        if claim != "ok":
+            self._running.discard(document_key)
+            if claim == "superseded":
+                logger.info(f"Save of {document_key} superseded by a newer save on another instance")
+                if self._pending.get(document_key) is job:
+                    self._drop(document_key)
+                else:
+                    self._schedule(document_key)
+            else:
+                loop = asyncio.get_running_loop()
+                self._retry_handles[document_key] = loop.call_later(
+                    self.retry_base_seconds, self._retry, document_key
+                )
+            return
+
+        start = time.perf_counter()
+        try:
+            ok = await self._save_func(job.document_key, job.url)
+        except Exception as e:
+            logger.error(f"Save of {document_key} raised: {e}")
+            ok = False
+        finally:
+            self._running.discard(document_key)
+            try:
+                await self._store.release(document_key)
+            except Exception as e:
+                logger.error(f"Could not release save lock of {document_key}: {e}")
+        elapsed = time.perf_counter() - start
+        SAVE_DURATION.labels("success" if ok else "failure").observe(elapsed)
+        await self._finish(job, ok, elapsed)
+
+    async def _remove_from_store(self, job: SaveJob) -> None:
+        try:
+            await self._store.remove(job.document_key, job.url)
+        except Exception as e:
+            # Left behind, the row is only re-run after a restart, which overwrites with the same content
+            logger.error(f"Could not remove finished save of {job.document_key} from the store: {e}")
+
+    async def _finish(self, job: SaveJob, ok: bool, elapsed: float) -> None:
+        document_key = job.document_key
+        superseded = self._pending.get(document_key) is not job
+        if ok:
+            self.completed += 1
+            self._latencies.append(elapsed)
+            await self._remove_from_store(job)
+        elif not superseded:
+            job.attempts += 1
+            if job.attempts >= self.max_attempts:
+                self.failed += 1
+                logger.error(f"Giving up on saving {document_key} after {job.attempts} attempts")
+                del self._pending[document_key]
+                await self._remove_from_store(job)
+                return
+            delay = min(self.retry_base_seconds * 2 ** (job.attempts - 1), self.retry_max_seconds)
+            self.retried += 1
+            logger.warning(f"Save of {document_key} failed, retrying in {delay:.1f}s (attempt {job.attempts})")
+            loop = asyncio.get_running_loop()
+            self._retry_handles[document_key] = loop.call_later(delay, self._retry, document_key)
+            return
+
+        if superseded:
+            # A newer callback arrived while this save was running
+            self._schedule(document_key)
+        else:
+            del self._pending[document_key]
+
+    def _retry(self, document_key: str) -> None:
+        self._retry_handles.pop(document_key, None)
+        self._schedule(document_key)
+
+    async def drain(self, timeout: float) -> None:
+        """Wait for queued saves to finish, then stop the workers; leftovers stay persisted"""
+        deadline = time.monotonic() + timeout
+        while (self._queued or self._running) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._pending:
+            logger.warning(f"Stopping save queue with {len(self._pending)} saves pending")
+        if self._lease_task:
+            # Leases then lapse and another instance adopts what is left
+            self._lease_task.cancel()
+            await asyncio.gather(self._lease_task, return_exceptions=True)
+            self._lease_task = None
+        for handle in self._retry_handles.values():
+            handle.cancel()
+        self._retry_handles.clear()
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        await self._store.close()
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+        return {
+            "depth": self.depth,
+            "queued": len(self._queued),
+            "running": len(self._running),
+            "waiting_retry": len(self._retry_handles),
+            "workers": self._workers_count,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "coalesced": self.coalesced,
+            "save_latency_seconds": {
+                "p50": latencies[len(latencies) // 2] if latencies else None,
+                "p95": latencies[int(len(latencies) * 0.95)] if latencies else None,
+                "max": latencies[-1] if latencies else None,
+            },
+        }
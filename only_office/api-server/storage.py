@@ -0,0 +1,386 @@
+"""
+Async S3 access layer for the ONLYOFFICE API server
+Runs every blocking MinIO call on a bounded executor so request handlers never stall the event loop
+"""
+
+import asyncio
+import functools
+import hashlib
+import io
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, AsyncIterator, BinaryIO, Callable, Dict, List, Optional, Tuple
+
+import urllib3
+from minio import Minio
+
+from metrics import DISK_WRITE_SECONDS, S3_DOWNLOADED_BYTES, S3_OPERATION_ERRORS, S3_OPERATION_LATENCY, S3_SLOT_WAIT
+
+logger = logging.getLogger(__name__)
+
+# Operation classes used for timeouts and concurrency limits; transfers are bounded by the
+# connection's connect/read timeouts instead of a deadline, so a large object is never cut off
+METADATA_OPS = ("bucket_exists", "make_bucket", "stat_object", "presigned_get_object")
+LIST_OPS = ("list_objects",)
+TRANSFER_OPS = ("get_object", "put_object", "fput_object")
+
+
+def build_http_client(pool_size: int, connect_timeout: float, read_timeout: float, retries: int) -> urllib3.PoolManager:
+    """Build the urllib3 connection pool shared by all MinIO calls"""
+    return urllib3.PoolManager(
+        num_pools=4,
+        maxsize=pool_size,
+        block=True,
+        timeout=urllib3.Timeout(connect=connect_timeout, read=read_timeout),
+        retries=urllib3.Retry(
+            total=retries,
+            backoff_factor=0.2,
+            status_forcelist=[500, 502, 503, 504],
+        ),
+    )
+
+
+class AsyncIteratorReader(io.RawIOBase):
+    """
+    Blocking file-like view of an async byte iterator, for use from an executor thread.
+
+    Chunks are pulled from the event loop only as the reader asks for them,
+    so a slow S3 upload applies backpressure to the source stream. Every
+    chunk can optionally be teed into a local file as it passes through,
+    with its SHA-256 taken on the way so the copy never has to be re-read.
+    After abort(), reads fail instead of touching the source again.
+    """
+
+    def __init__(self, chunks: AsyncIterator[bytes], loop: asyncio.AbstractEventLoop, tee: Optional[BinaryIO] = None):
+        self._chunks = chunks
+        self._loop = loop
+        self.tee = tee
+        self.tee_digest = hashlib.sha256()
+        self._buffer = bytearray()
+        self._eof = False
+        self._aborted = False
+        self._pending: Optional[Future] = None
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    async def _next_chunk(self) -> Optional[bytes]:
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    def abort(self) -> None:
+        """Stop pulling from the source, e.g. once the caller has gone and closed it"""
+        self._aborted = True
+        if self._pending:
+            self._pending.cancel()
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            if self._aborted:
+                raise IOError("Upload source was aborted")
+            self._pending = asyncio.run_coroutine_threadsafe(self._next_chunk(), self._loop)
+            chunk = self._pending.result()
+            if chunk is None:
+                self._eof = True
+                break
+            if self.tee:
+                self.tee.write(chunk)
+                self.tee_digest.update(chunk)
+            self._buffer += chunk
+        if size < 0 or size >= len(self._buffer):
+            data = bytes(self._buffer)
+            self._buffer.clear()
+        else:
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+        self.bytes_read += len(data)
+        return data
+
+
+class AsyncStorage:
+    """
+    Async facade over a synchronous MinIO client.
+
+    Metadata calls (stat, bucket checks) and transfers (get/put) get separate
+    concurrency limits, so a burst of large uploads cannot starve the small
+    lookups that /editor and /download depend on.
+    """
+
+    def __init__(
+        self,
+        client: Minio,
+        bucket: str,
+        max_concurrent_requests: int = 16,
+        max_concurrent_transfers: int = 8,
+        metadata_timeout: float = 10.0,
+        list_timeout: float = 60.0,
+        part_size: int = 16 * 1024 * 1024,
+        parallel_part_uploads: int = 3,
+    ):
+        self.client = client
+        self.bucket = bucket
+        self.part_size = part_size
+        self.parallel_part_uploads = parallel_part_uploads
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_requests + max_concurrent_transfers,
+            thread_name_prefix="s3",
+        )
+        self._request_slots = asyncio.Semaphore(max_concurrent_requests)
+        self._transfer_slots = asyncio.Semaphore(max_concurrent_transfers)
+        self._timeouts: Dict[str, float] = {}
+        for op in METADATA_OPS:
+            self._timeouts[op] = metadata_timeout
+        for op in LIST_OPS:
+            self._timeouts[op] = list_timeout
+
+    async def _run(self, op: str, func: Callable, *args, **kwargs) -> Any:
+        """
+        Run a blocking call on the executor under the op's concurrency limit and timeout.
+
+        The slot is held until the executor thread returns, not until the
+        caller stops waiting: a timed-out or cancelled call keeps its thread
+        busy, and releasing early would let more calls pile onto the pool.
+        """
+        pool = "transfer" if op in TRANSFER_OPS else "request"
+        slots = self._transfer_slots if op in TRANSFER_OPS else self._request_slots
+        queued_at = time.perf_counter()
+        await slots.acquire()
+        start = time.perf_counter()
+        S3_SLOT_WAIT.labels(pool).observe(start - queued_at)
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        except BaseException:
+            slots.release()
+            raise
+
+        def _done(done: asyncio.Future) -> None:
+            slots.release()
+            S3_OPERATION_LATENCY.labels(op).observe(time.perf_counter() - start)
+            if not done.cancelled() and done.exception() is not None:
+                e = done.exception()
+                S3_OPERATION_ERRORS.labels(op, getattr(e, "code", None) or type(e).__name__).inc()
+
+        future.add_done_callback(_done)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self._timeouts.get(op))
+        except asyncio.TimeoutError:
+            S3_OPERATION_ERRORS.labels(op, "Timeout").inc()
+            logger.error(f"S3 {op} timed out after {self._timeouts.get(op)}s")
+            raise
+
+    async def bucket_exists(self) -> bool:
+        return await self._run("bucket_exists", self.client.bucket_exists, self.bucket)
+
+    async def make_bucket(self) -> None:
+        await self._run("make_bucket", self.client.make_bucket, self.bucket)
+
+    async def stat_object(self, object_name: str):
+        """Return the object's stat; raises S3Error (code NoSuchKey) when it does not exist"""
+        return await self._run("stat_object", self.client.stat_object, self.bucket, object_name)
+
+    async def presigned_get_object(self, object_name: str, expires_seconds: int) -> str:
+        """Return a presigned GET URL (computed locally unless the bucket region must be looked up)"""
+        return await self._run(
+            "presigned_get_object",
+            self.client.presigned_get_object,
+            self.bucket,
+            object_name,
+            expires=timedelta(seconds=expires_seconds),
+        )
+
+    async def list_objects(self, prefix: Optional[str] = None, recursive: bool = True) -> List[Any]:
+        """List objects; the paginated S3 iteration runs entirely on the executor"""
+        def _list():
+            return list(self.client.list_objects(self.bucket, prefix=prefix, recursive=recursive))
+        return await self._run("list_objects", _list)
+
+    async def iter_objects(
+        self,
+        prefix: Optional[str] = None,
+        start_after: Optional[str] = None,
+        batch_size: int = 1000,
+    ) -> AsyncIterator[List[Any]]:
+        """
+        Yield the listing in batches as S3 returns them.
+
+        Each batch is pulled on the executor, and a batch of 1000 matches one
+        S3 LIST page, so the caller sees entries as pages arrive and stopping
+        early skips the remaining LIST requests.
+        """
+        iterator = self.client.list_objects(
+            self.bucket, prefix=prefix, recursive=True, start_after=start_after
+        )
+
+        def _next_batch():
+            return list(itertools.islice(iterator, batch_size))
+
+        while True:
+            batch = await self._run("list_objects", _next_batch)
+            if batch:
+                yield batch
+            if len(batch) < batch_size:
+                break
+
+    async def download_to_file(self, object_name: str, file_path: Path) -> Tuple[int, Optional[str], str]:
+        """Stream an object into a local file; returns (bytes written, ETag of the bytes served, hex SHA-256)"""
+        abandoned = threading.Event()
+
+        def _download():
+            response = self.client.get_object(self.bucket, object_name)
+            written = 0
+            write_seconds = 0.0
+            digest = hashlib.sha256()
+            try:
+                etag = (response.headers.get("ETag") or "").replace('"', "") or None
+                with open(file_path, "wb") as f:
+                    for chunk in response.stream(256 * 1024):
+                        if abandoned.is_set():
+                            # The caller is gone and discards the partial file
+                            raise IOError(f"Download of {object_name} abandoned")
+                        write_start = time.perf_counter()
+                        f.write(chunk)
+                        write_seconds += time.perf_counter() - write_start
+                        digest.update(chunk)
+                        written += len(chunk)
+            finally:
+                response.close()
+                response.release_conn()
+                S3_DOWNLOADED_BYTES.inc(written)
+                DISK_WRITE_SECONDS.inc(write_seconds)
+            return written, etag, digest.hexdigest()
+        try:
+            return await self._run("get_object", _download)
+        finally:
+            abandoned.set()
+
+    async def put_object(self, object_name: str, data: BinaryIO, length: int = -1, content_type: str = "application/octet-stream"):
+        """
+        Upload from a file-like object, reading it one part at a time.
+
+        Objects larger than part_size go up as a multipart upload, so memory
+        stays at a few part sizes however large the object is. Pass length=-1
+        when the size is not known up front.
+        """
+        return await self._run(
+            "put_object",
+            self.client.put_object,
+            self.bucket,
+            object_name,
+            data,
+            length,
+            content_type=content_type,
+            part_size=self.part_size,
+            num_parallel_uploads=self.parallel_part_uploads,
+        )
+
+    async def put_stream(
+        self,
+        object_name: str,
+        chunks: AsyncIterator[bytes],
+        length: int = -1,
+        content_type: str = "application/octet-stream",
+        tee_path: Optional[Path] = None,
+    ) -> Tuple[Any, int, Optional[str]]:
+        """
+        Upload an async byte stream without buffering it; returns (write result, bytes uploaded, tee SHA-256).
+
+        With a known length, a source that turns out shorter or longer raises
+        IOError after the upload, so the caller can retry instead of keeping a
+        truncated object.
+
+        When tee_path is given, the same bytes are written to that local file
+        as they are uploaded and the hex SHA-256 of the file is returned;
+        otherwise the digest is None.
+        """
+        reader = AsyncIteratorReader(chunks, asyncio.get_running_loop())
+
+        def _upload():
+            tee = open(tee_path, "wb") if tee_path else None
+            reader.tee = tee
+            try:
+                result = self.client.put_object(
+                    self.bucket,
+                    object_name,
+                    reader,
+                    length,
+                    content_type=content_type,
+                    part_size=self.part_size,
+                    num_parallel_uploads=self.parallel_part_uploads,
+                )
+                # put_object stops at length, so a longer source would otherwise be stored cut off
+                if length >= 0 and (reader.bytes_read != length or reader.read(1)):
+                    raise IOError(f"Upload source for {object_name} does not match its declared length of {length} bytes")
+                return result, reader.bytes_read, reader.tee_digest.hexdigest() if tee else None
+            finally:
+                if tee:
+                    tee.close()
+        try:
+            return await self._run("put_object", _upload)
+        finally:
+            # A cancelled caller closes the source stream; the upload thread must not read it afterwards
+            reader.abort()
+
+    async def fput_object(self, object_name: str, file_path: Path, content_type: str = "application/octet-stream"):
+        return await self._run(
+            "fput_object",
+            self.client.fput_object,
+            self.bucket,
+            object_name,
+            str(file_path),
+            content_type=content_type,
+            part_size=self.part_size,
+            num_parallel_uploads=self.parallel_part_uploads,
+        )
+
+    def shutdown(self) -> None:
+        """Stop accepting work and release executor threads"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class PresignedUrlCache:
+    """
+    Reuses presigned GET URLs until shortly before they expire.
+
+    At most max_entries URLs are kept, least recently used first out, and
+    expired URLs at the cold end are dropped whenever a new one is added.
+    """
+
+    def __init__(self, storage: AsyncStorage, expiry_seconds: int, refresh_margin_seconds: int, max_entries: int = 10000):
+        self.storage = storage
+        self.expiry_seconds = expiry_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.max_entries = max_entries
+        # object key -> (url, time.monotonic() after which it must be re-signed)
+        self._urls: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._urls)
+
+    async def get(self, object_name: str) -> str:
+        cached = self._urls.get(object_name)
+        if cached and time.monotonic() < cached[1]:
+            self._urls.move_to_end(object_name)
+            return cached[0]
+        url = await self.storage.presigned_get_object(object_name, self.expiry_seconds)
+        now = time.monotonic()
+        self._urls[object_name] = (url, now + self.expiry_seconds - self.refresh_margin_seconds)
+        self._urls.move_to_end(object_name)
+        while self._urls:
+            oldest = next(iter(self._urls.values()))
+            if len(self._urls) <= self.max_entries and now < oldest[1]:
+                break
+            self._urls.popitem(last=False)
+        return url
+
+    def invalidate(self, object_name: str) -> None:
+        self._urls.pop(object_name, None)
@@ -0,0 +1,644 @@
+"""
+Temporary file cache helpers
+Budgeted LRU cache of ETag-validated S3 objects stored as content-addressed blobs, with a RAM tier for hot
+small files, single-flight coalescing of S3 fetches and atomic writes into TEMP_DIR
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from metrics import TEMP_CACHE_MEMORY_EVENTS, TEMP_CACHE_REMOVALS
+
+logger = logging.getLogger(__name__)
+
+PARTIAL_SUFFIX = ".part"
+BLOB_DIR = "blobs"
+PARTIAL_DIR = "partial"
+CATALOG_FILE = "catalog.db"
+
+
+def discard_partial(partial: Path) -> None:
+    try:
+        partial.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def content_hash(path: Path) -> str:
+    """Hex SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into a single execution.
+
+    The work runs as its own task, so a caller that disconnects does not
+    cancel the fetch for everyone else waiting on it.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._inflight
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            logger.info(f"Joining in-flight fetch for {key}")
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+
+class CacheEntry:
+    """Source-object metadata recorded for a cached S3 object"""
+
+    __slots__ = ("s3_key", "content_hash", "etag", "last_modified", "size", "validated_at", "last_access", "hits")
+
+    def __init__(self, s3_key: str, content_hash: str, etag: Optional[str], last_modified: Optional[datetime], size: int):
+        self.s3_key = s3_key
+        self.content_hash = content_hash
+        self.etag = etag
+        self.last_modified = last_modified
+        self.size = size
+        self.validated_at = time.monotonic()
+        self.last_access = time.time()
+        self.hits = 0  # Accesses since recorded, halved by every maintenance pass
+
+    @property
+    def filename(self) -> str:
+        return self.s3_key.split("/")[-1]
+
+    @property
+    def validated_wall_time(self) -> float:
+        """validated_at as a time.time() value, 0 when the entry must be revalidated"""
+        if self.validated_at == float("-inf"):
+            return 0.0
+        return time.time() - (time.monotonic() - self.validated_at)
+
+
+class MemoryTier:
+    """
+    RAM copies of small, frequently read cache entries.
+
+    Buffers are immutable and tagged with the ETag they were read for, so a
+    newer version on disk is never shadowed by a stale buffer. Over budget,
+    the buffer with the fewest hits (least recently accessed among equals)
+    is demoted back to disk-only.
+    """
+
+    def __init__(self, max_bytes: int, max_object_bytes: int, promote_hits: int):
+        self.max_bytes = max_bytes
+        self.max_object_bytes = max_object_bytes
+        self.promote_hits = promote_hits
+        self.total_bytes = 0
+        # S3 key -> (ETag the bytes belong to, read-only view of the bytes)
+        self._buffers: Dict[str, Tuple[Optional[str], memoryview]] = {}
+
+    def __len__(self) -> int:
+        return len(self._buffers)
+
+    def get(self, entry: CacheEntry) -> Optional[memoryview]:
+        buffer = self._buffers.get(entry.s3_key)
+        if buffer is None:
+            return None
+        if buffer[0] != entry.etag:
+            self.discard(entry.s3_key)
+            return None
+        return buffer[1]
+
+    def should_promote(self, entry: CacheEntry) -> bool:
+        return (
+            self.max_bytes > 0
+            and entry.etag is not None
+            and entry.size <= min(self.max_object_bytes, self.max_bytes)
+            and entry.hits >= self.promote_hits
+        )
+
+    def put(self, entry: CacheEntry, data: bytes, entries: Dict[str, CacheEntry]) -> memoryview:
+        self.discard(entry.s3_key)
+        view = memoryview(data).toreadonly()
+        self._buffers[entry.s3_key] = (entry.etag, view)
+        self.total_bytes += len(data)
+        TEMP_CACHE_MEMORY_EVENTS.labels("promotion").inc()
+        while self.total_bytes > self.max_bytes:
+            victim = min(
+                (key for key in self._buffers if key != entry.s3_key),
+                key=lambda key: (entries[key].hits, entries[key].last_access) if key in entries else (-1, 0),
+            )
+            self.discard(victim)
+            TEMP_CACHE_MEMORY_EVENTS.labels("demotion").inc()
+        return view
+
+    def discard(self, s3_key: str) -> None:
+        buffer = self._buffers.pop(s3_key, None)
+        if buffer is not None:
+            self.total_bytes -= len(buffer[1])
+
+
+class CacheCatalog:
+    """
+    Cache entries persisted in a SQLite database (WAL mode) next to the blobs.
+
+    Adding and removing an entry each commit immediately. Access times, hit
+    counts and validation times change on every read, so the cache buffers
+    them and writes them in one transaction per flush.
+    """
+
+    COLUMNS = "s3_key, content_hash, etag, size, last_modified, validated_at, last_access, hits"
+
+    def __init__(self, path: Path):
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            "s3_key TEXT PRIMARY KEY, content_hash TEXT NOT NULL, etag TEXT, size INTEGER NOT NULL, "
+            "last_modified TEXT, validated_at REAL NOT NULL, last_access REAL NOT NULL, hits INTEGER NOT NULL)"
+        )
+
+    @staticmethod
+    def _row(entry: CacheEntry) -> tuple:
+        return (
+            entry.s3_key,
+            entry.content_hash,
+            entry.etag,
+            entry.size,
+            entry.last_modified.isoformat() if entry.last_modified else None,
+            entry.validated_wall_time,
+            entry.last_access,
+            entry.hits,
+        )
+
+    @staticmethod
+    def _entry(row: tuple) -> CacheEntry:
+        s3_key, digest, etag, size, last_modified, validated_at, last_access, hits = row
+        entry = CacheEntry(s3_key, digest, etag, datetime.fromisoformat(last_modified) if last_modified else None, size)
+        # Keeps its place in the freshness window across a restart
+        entry.validated_at = time.monotonic() - (time.time() - validated_at) if validated_at else float("-inf")
+        entry.last_access = last_access
+        entry.hits = hits
+        return entry
+
+    def put(self, entry: CacheEntry) -> None:
+        self._conn.execute(f"INSERT OR REPLACE INTO cache_entries ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self._row(entry))
+
+    def remove(self, s3_key: str) -> None:
+        self._conn.execute("DELETE FROM cache_entries WHERE s3_key = ?", (s3_key,))
+
+    def remove_many(self, s3_keys: List[str]) -> None:
+        """Delete several entries in one transaction"""
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("DELETE FROM cache_entries WHERE s3_key = ?", [(s3_key,) for s3_key in s3_keys])
+
+    def update_usage(self, entries: List[CacheEntry]) -> None:
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "UPDATE cache_entries SET validated_at = ?, last_access = ?, hits = ? WHERE s3_key = ?",
+                [(entry.validated_wall_time, entry.last_access, entry.hits, entry.s3_key) for entry in entries],
+            )
+
+    def halve_hits(self) -> None:
+        self._conn.execute("UPDATE cache_entries SET hits = hits / 2")
+
+    def load(self) -> List[CacheEntry]:
+        """All entries, least recently accessed first"""
+        rows = self._conn.execute(f"SELECT {self.COLUMNS} FROM cache_entries ORDER BY last_access").fetchall()
+        return [self._entry(row) for row in rows]
+
+    def page(self, start_after: Optional[str], limit: int) -> List[CacheEntry]:
+        """Up to limit entries in S3 key order, starting after start_after"""
+        rows = self._conn.execute(
+            f"SELECT {self.COLUMNS} FROM cache_entries WHERE s3_key > ? ORDER BY s3_key LIMIT ?",
+            (start_after or "", limit),
+        ).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class TempFileCache:
+    """
+    Byte- and entry-budgeted LRU cache of S3 objects in TEMP_DIR.
+
+    Entries are keyed by S3 key and point at content-addressed blobs stored
+    under blobs/ab/cd/<sha256>, so identical objects under different keys
+    share one file and no directory grows past a few hundred entries. The
+    key -> blob mapping lives in memory and in a SQLite catalog, so startup
+    and listings never have to walk or stat the blob tree.
+
+    An entry is served straight from disk while it was validated within the
+    freshness window; after that the caller revalidates it against S3.
+    Recording a new entry evicts the least recently accessed unpinned entries
+    until the cache is back within budget. Objects open in an editing session
+    are pinned and never evicted.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        freshness_seconds: float,
+        max_bytes: int,
+        max_entries: int,
+        memory_max_bytes: int = 0,
+        memory_max_object_bytes: int = 1024 * 1024,
+        memory_promote_hits: int = 2,
+    ):
+        self.root = root
+        self.blob_root = root / BLOB_DIR
+        self.partial_root = root / PARTIAL_DIR
+        self.blob_root.mkdir(parents=True, exist_ok=True)
+        self.partial_root.mkdir(parents=True, exist_ok=True)
+        self.freshness_seconds = freshness_seconds
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.total_bytes = 0  # Bytes of unique blobs, so deduplicated objects count once
+        self.entry_bytes = 0  # Sum of entry sizes, counting shared blobs once per entry
+        self.memory = MemoryTier(memory_max_bytes, memory_max_object_bytes, memory_promote_hits)
+        # Ordered least recently accessed first
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        # content hash -> number of entries referencing the blob
+        self._blob_refs: Dict[str, int] = {}
+        # S3 key -> time.time() at which the pin lapses
+        self._pins: Dict[str, float] = {}
+        self.catalog = CacheCatalog(root / CATALOG_FILE)
+        # S3 keys whose access time, hits or validation time changed since the last flush
+        self._dirty: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[CacheEntry]:
+        return iter(list(self._entries.values()))
+
+    @property
+    def blob_count(self) -> int:
+        return len(self._blob_refs)
+
+    def blob_path(self, digest: str) -> Path:
+        return self.blob_root / digest[:2] / digest[2:4] / digest
+
+    def path_for(self, s3_key: str) -> Optional[Path]:
+        entry = self._entries.get(s3_key)
+        return self.blob_path(entry.content_hash) if entry else None
+
+    def new_partial(self) -> Path:
+        """Unique path to write into before the file is committed as a blob"""
+        return self.partial_root / f"{uuid.uuid4().hex}{PARTIAL_SUFFIX}"
+
+    def get(self, s3_key: str) -> Optional[CacheEntry]:
+        return self._entries.get(s3_key)
+
+    def touch(self, s3_key: str) -> None:
+        """Mark an entry as just accessed"""
+        entry = self._entries.get(s3_key)
+        if entry:
+            entry.last_access = time.time()
+            entry.hits += 1
+            self._entries.move_to_end(s3_key)
+            self._dirty.add(s3_key)
+
+    async def commit(
+        self,
+        s3_key: str,
+        partial: Path,
+        etag: Optional[str],
+        last_modified: Optional[datetime] = None,
+        digest: Optional[str] = None,
+    ) -> CacheEntry:
+        """
+        Move a completed partial file into its content-addressed blob and record it for s3_key.
+
+        Writers that hash the bytes as they stream them pass the digest;
+        without one the partial file is read back to hash it.
+        """
+        if digest is None:
+            digest = await asyncio.to_thread(content_hash, partial)
+        size = partial.stat().st_size
+        # No awaits from here on: an eviction cannot delete the blob between the check and the record
+        blob = self.blob_path(digest)
+        if digest in self._blob_refs and blob.exists():
+            # The same bytes are already cached, e.g. under another prefix
+            discard_partial(partial)
+        else:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(partial, blob)
+        return self.record(s3_key, digest, etag, size, last_modified)
+
+    def record(self, s3_key: str, digest: str, etag: Optional[str], size: int, last_modified: Optional[datetime] = None) -> CacheEntry:
+        """Record the object version now held in a blob; the entry starts out fresh"""
+        entry = CacheEntry(s3_key, digest, etag, last_modified, size)
+        # Reference the new blob before releasing the old one, in case they are the same
+        self._add_ref(digest, size)
+        self._drop(s3_key, persist=False)
+        self._entries[s3_key] = entry
+        self.entry_bytes += size
+        self.catalog.put(entry)
+        self.evict(protect=s3_key)
+        return entry
+
+    def load(self) -> int:
+        """
+        Rebuild the entries from the catalog (e.g. after a restart).
+
+        Blobs are not listed or stat'ed: entries validated within the
+        freshness window before the restart are served straight away, older
+        ones revalidate against S3 on first access, and one whose blob has
+        gone missing is refetched.
+        """
+        for entry in self.catalog.load():
+            self._add_ref(entry.content_hash, entry.size)
+            self._entries[entry.s3_key] = entry
+            self.entry_bytes += entry.size
+        self._remove_flat_files()
+        return len(self._entries)
+
+    def _remove_flat_files(self) -> None:
+        """Files from the old flat layout do not record their S3 key, so they cannot be adopted"""
+        removed = 0
+        with os.scandir(self.root) as it:
+            for dir_entry in it:
+                if dir_entry.is_file() and not dir_entry.name.startswith(CATALOG_FILE):
+                    discard_partial(Path(dir_entry.path))
+                    removed += 1
+        if removed:
+            logger.info(f"Removed {removed} temp files left over from the flat cache layout")
+
+    def flush(self) -> int:
+        """Write buffered access times, hit counts and validation times to the catalog"""
+        if not self._dirty:
+            return 0
+        entries = [self._entries[s3_key] for s3_key in self._dirty if s3_key in self._entries]
+        self._dirty.clear()
+        self.catalog.update_usage(entries)
+        return len(entries)
+
+    def page(self, start_after: Optional[str], limit: int) -> List[CacheEntry]:
+        """A page of catalog entries in S3 key order, with buffered usage written first"""
+        self.flush()
+        return self.catalog.page(start_after, limit)
+
+    def close(self) -> None:
+        self.flush()
+        self.catalog.close()
+
+    def in_memory(self, entry: CacheEntry) -> bool:
+        """True when the RAM tier holds this version, so it can be served without any disk access"""
+        return self.memory.get(entry) is not None
+
+    def buffer_for(self, s3_key: str) -> Optional[memoryview]:
+        """
+        RAM copy of a cached object, or None to serve it from disk.
+
+        A small object is read into memory once it has been accessed
+        memory_promote_hits times since it was last written.
+        """
+        entry = self._entries.get(s3_key)
+        if entry is None:
+            return None
+        buffer = self.memory.get(entry)
+        if buffer is not None:
+            TEMP_CACHE_MEMORY_EVENTS.labels("hit").inc()
+            return buffer
+        if not self.memory.should_promote(entry):
+            return None
+        try:
+            data = self.blob_path(entry.content_hash).read_bytes()
+        except FileNotFoundError:
+            return None
+        if len(data) != entry.size:
+            return None
+        return self.memory.put(entry, data, self._entries)
+
+    def decay_hits(self) -> None:
+        """Halve access counts so popularity reflects recent traffic"""
+        self.flush()
+        for entry in self._entries.values():
+            entry.hits //= 2
+        self.catalog.halve_hits()
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return time.monotonic() - entry.validated_at < self.freshness_seconds
+
+    def mark_validated(self, entry: CacheEntry) -> None:
+        entry.validated_at = time.monotonic()
+        self._dirty.add(entry.s3_key)
+
+    def invalidate(self, s3_key: str) -> None:
+        """Force the next access to revalidate the entry against S3"""
+        entry = self._entries.get(s3_key)
+        if entry:
+            entry.validated_at = float("-inf")
+            # Written straight away, so a restart cannot resurrect a copy known to be stale
+            self.catalog.put(entry)
+
+    def pin(self, s3_key: str, ttl_seconds: float) -> None:
+        """Protect an object from eviction while it is being edited; re-pinning extends the pin"""
+        self._pins[s3_key] = time.time() + ttl_seconds
+
+    def unpin(self, s3_key: str) -> None:
+        self._pins.pop(s3_key, None)
+
+    def is_pinned(self, s3_key: str) -> bool:
+        expires = self._pins.get(s3_key)
+        if expires is None:
+            return False
+        if expires < time.time():
+            del self._pins[s3_key]
+            return False
+        return True
+
+    def evict(self, protect: Optional[str] = None, limit: Optional[int] = None) -> List[CacheEntry]:
+        """Evict least recently accessed unpinned entries until within the byte and entry budgets"""
+        evicted = []
+        for s3_key in list(self._entries):
+            if self.total_bytes <= self.max_bytes and len(self._entries) <= self.max_entries:
+                break
+            if limit is not None and len(evicted) >= limit:
+                break
+            if s3_key == protect or self.is_pinned(s3_key):
+                continue
+            evicted.append(self._remove(s3_key, persist=False))
+        if evicted:
+            self.catalog.remove_many([entry.s3_key for entry in evicted])
+            TEMP_CACHE_REMOVALS.labels("budget").inc(len(evicted))
+            logger.info(f"Evicted {len(evicted)} temp files, cache now {self.total_bytes} bytes in {len(self._entries)} entries")
+        return evicted
+
+    def expire(self, max_age_seconds: float, limit: Optional[int] = None) -> List[CacheEntry]:
+        """Remove unpinned entries that have not been accessed within max_age_seconds"""
+        cutoff = time.time() - max_age_seconds
+        expired = []
+        for s3_key, entry in list(self._entries.items()):
+            if entry.last_access >= cutoff:
+                # Entries are in access order, so everything after this is newer
+                break
+            if limit is not None and len(expired) >= limit:
+                break
+            if self.is_pinned(s3_key):
+                continue
+            expired.append(self._remove(s3_key, persist=False))
+        if expired:
+            self.catalog.remove_many([entry.s3_key for entry in expired])
+            TEMP_CACHE_REMOVALS.labels("ttl").inc(len(expired))
+        return expired
+
+    def forget(self, s3_key: str) -> Optional[CacheEntry]:
+        """Remove an entry; its blob is deleted once no other entry references it"""
+        if s3_key not in self._entries:
+            return None
+        return self._remove(s3_key)
+
+    def _add_ref(self, digest: str, size: int) -> None:
+        refs = self._blob_refs.get(digest, 0)
+        if refs == 0:
+            self.total_bytes += size
+        self._blob_refs[digest] = refs + 1
+
+    def _release_ref(self, entry: CacheEntry) -> None:
+        refs = self._blob_refs.get(entry.content_hash, 0) - 1
+        if refs > 0:
+            self._blob_refs[entry.content_hash] = refs
+            return
+        self._blob_refs.pop(entry.content_hash, None)
+        self.total_bytes -= entry.size
+        discard_partial(self.blob_path(entry.content_hash))
+
+    def _drop(self, s3_key: str, persist: bool = True) -> None:
+        entry = self._entries.pop(s3_key, None)
+        self.memory.discard(s3_key)
+        self._dirty.discard(s3_key)
+        if entry:
+            self.entry_bytes -= entry.size
+            self._release_ref(entry)
+            if persist:
+                self.catalog.remove(s3_key)
+
+    def _remove(self, s3_key: str, persist: bool = True) -> CacheEntry:
+        entry = self._entries[s3_key]
+        self._drop(s3_key, persist)
+        return entry
+
+
+class CacheMaintainer:
+    """
+    Periodic temp cache upkeep: TTL expiry, budget eviction and removal of
+    abandoned partial files.
+
+    Work is done in batches with a yield to the event loop between them, so
+    a large cache never blocks request handling for a whole scan.
+    """
+
+    def __init__(self, cache: TempFileCache, interval_seconds: float, ttl_seconds: float, batch_size: int = 200):
+        self.cache = cache
+        self.interval_seconds = interval_seconds
+        self.ttl_seconds = ttl_seconds
+        self.batch_size = batch_size
+        self.runs = 0
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def run_once(self) -> Dict[str, Any]:
+        """Run one maintenance pass and return what it freed"""
+        async with self._lock:
+            started_at = datetime.now()
+            start = time.perf_counter()
+            freed: List[CacheEntry] = []
+
+            while True:
+                batch = self.cache.expire(self.ttl_seconds, limit=self.batch_size)
+                freed.extend(batch)
+                await asyncio.sleep(0)
+                if len(batch) < self.batch_size:
+                    break
+            expired_count = len(freed)
+
+            while True:
+                batch = self.cache.evict(limit=self.batch_size)
+                freed.extend(batch)
+                await asyncio.sleep(0)
+                if len(batch) < self.batch_size:
+                    break
+
+            partials_removed = await self._remove_stale_partials()
+            self.cache.decay_hits()
+
+            self.runs += 1
+            self.last_report = {
+                "started_at": started_at.isoformat(),
+                "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+                "expired_files": expired_count,
+                "evicted_files": len(freed) - expired_count,
+                "partial_files_removed": partials_removed,
+                "bytes_freed": sum(entry.size for entry in freed),
+                "cache_bytes": self.cache.total_bytes,
+                "cache_files": len(self.cache),
+                "memory_bytes": self.cache.memory.total_bytes,
+                "memory_files": len(self.cache.memory),
+            }
+            if freed or partials_removed:
+                logger.info(f"Temp cache maintenance freed {len(freed)} files ({self.last_report['bytes_freed']} bytes)")
+            return self.last_report
+
+    async def _remove_stale_partials(self) -> int:
+        """Delete partial files from interrupted writes that are older than the TTL"""
+        cutoff = time.time() - self.ttl_seconds
+        removed = 0
+        with os.scandir(self.cache.partial_root) as it:
+            for i, dir_entry in enumerate(it, 1):
+                if dir_entry.name.endswith(PARTIAL_SUFFIX) and dir_entry.stat().st_mtime < cutoff:
+                    discard_partial(Path(dir_entry.path))
+                    removed += 1
+                if i % self.batch_size == 0:
+                    await asyncio.sleep(0)
+        return removed
+
+    async def _run_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Temp cache maintenance failed: {e}")
+
+    def start(self) -> None:
+        if self._task is None and self.interval_seconds > 0:
+            self._task = asyncio.create_task(self._run_forever())
+            logger.info(f"Temp cache maintenance scheduled every {self.interval_seconds}s")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
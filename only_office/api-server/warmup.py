@@ -0,0 +1,217 @@
+"""
+Temp cache warm-up
+Prefetches selected S3 objects into the local cache as tracked background jobs, and a CLI to start and follow them
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from temp_cache import CacheEntry, TempFileCache
+
+logger = logging.getLogger(__name__)
+
+# Per-job list of failures kept for the progress report
+MAX_REPORTED_ERRORS = 20
+
+
+class WarmupJob:
+    """Progress of one warm-up run"""
+
+    def __init__(self, selector: Dict[str, Any], concurrency: int):
+        self.id = uuid.uuid4().hex[:12]
+        self.selector = selector
+        self.concurrency = concurrency
+        self.status = "pending"  # pending | listing | running | done | failed | cancelled
+        self.total = 0
+        self.fetched = 0  # Downloaded (or refreshed) from S3 or a peer
+        self.already_cached = 0  # Current copy was in the cache already
+        self.failed = 0
+        self.bytes_fetched = 0
+        self.errors: List[Dict[str, str]] = []
+        self.error: Optional[str] = None
+        self.created_at = datetime.now()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def completed(self) -> int:
+        return self.fetched + self.already_cached + self.failed
+
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.finished_at or time.perf_counter()
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "selector": self.selector,
+            "concurrency": self.concurrency,
+            "total": self.total,
+            "completed": self.completed,
+            "fetched": self.fetched,
+            "already_cached": self.already_cached,
+            "failed": self.failed,
+            "bytes_fetched": self.bytes_fetched,
+            "created_at": self.created_at.isoformat(),
+            "elapsed_seconds": round(end - self.started_at, 3) if self.started_at else 0,
+            "errors": self.errors,
+            "error": self.error,
+        }
+
+
+class WarmupManager:
+    """
+    Runs warm-up jobs and keeps the most recent ones for progress queries.
+
+    Each job lists its keys first, then fetches them with `concurrency`
+    workers through the normal cache fill path, so coalescing, peer fill and
+    ETag revalidation all apply.
+    """
+
+    def __init__(self, cache: TempFileCache, fetch: Callable[[str], Awaitable[Optional[CacheEntry]]], max_jobs: int = 20):
+        self.cache = cache
+        self._fetch = fetch
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, WarmupJob]" = OrderedDict()
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def start(self, selector: Dict[str, Any], select: Callable[[], Awaitable[List[str]]], concurrency: int) -> WarmupJob:
+        job = WarmupJob(selector, concurrency)
+        self._jobs[job.id] = job
+        while len(self._jobs) > self.max_jobs:
+            oldest = next(iter(self._jobs))
+            if oldest in self._tasks:
+                break
+            del self._jobs[oldest]
+        task = asyncio.create_task(self._run(job, select))
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda done: self._tasks.pop(job.id, None))
+        return job
+
+    def get(self, job_id: str) -> Optional[WarmupJob]:
+        return self._jobs.get(job_id)
+
+    def __iter__(self):
+        return iter(list(self._jobs.values()))
+
+    async def _run(self, job: WarmupJob, select: Callable[[], Awaitable[List[str]]]) -> None:
+        job.started_at = time.perf_counter()
+        try:
+            job.status = "listing"
+            keys = await select()
+            job.total = len(keys)
+            job.status = "running"
+            logger.info(f"Warm-up {job.id}: prefetching {len(keys)} objects, {job.concurrency} at a time")
+
+            remaining = iter(keys)
+
+            async def worker():
+                for s3_key in remaining:
+                    await self._warm(job, s3_key)
+
+            await asyncio.gather(*(worker() for _ in range(max(1, min(job.concurrency, len(keys))))))
+            job.status = "done"
+            logger.info(
+                f"Warm-up {job.id} done: {job.fetched} fetched ({job.bytes_fetched} bytes), "
+                f"{job.already_cached} already cached, {job.failed} failed"
+            )
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"Warm-up {job.id} failed: {e}")
+        finally:
+            job.finished_at = time.perf_counter()
+
+    async def _warm(self, job: WarmupJob, s3_key: str) -> None:
+        before = self.cache.get(s3_key)
+        try:
+            entry = await self._fetch(s3_key)
+        except Exception as e:
+            entry = None
+            logger.error(f"Warm-up {job.id}: error fetching {s3_key}: {e}")
+        if entry is None:
+            job.failed += 1
+            if len(job.errors) < MAX_REPORTED_ERRORS:
+                job.errors.append({"s3_key": s3_key, "error": "not found or fetch failed"})
+        elif before is not None and before.content_hash == entry.content_hash:
+            job.already_cached += 1
+        else:
+            job.fetched += 1
+            job.bytes_fetched += entry.size
+
+    async def stop(self) -> None:
+        """Cancel running jobs"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Prefetch documents into an API server's temp cache, e.g. from cron before peak hours"
+    )
+    parser.add_argument("--url", default="http://localhost:3000", help="API server base URL")
+    parser.add_argument("--prefix", help="Warm every object under this S3 prefix")
+    parser.add_argument("--keys", nargs="*", default=None, help="S3 keys or filenames to warm")
+    parser.add_argument("--keys-file", help="File with one S3 key or filename per line")
+    parser.add_argument("--modified-within-hours", type=float, help="Only objects modified within this many hours")
+    parser.add_argument("--limit", type=int, help="Warm at most this many objects")
+    parser.add_argument("--concurrency", type=int, help="Parallel fetches (default: the server's WARMUP_CONCURRENCY)")
+    parser.add_argument("--poll-seconds", type=float, default=2.0)
+    parser.add_argument("--no-wait", action="store_true", help="Start the job and exit without following it")
+    return parser.parse_args()
+
+
+def main_cli() -> int:
+    args = parse_args()
+    keys = list(args.keys or [])
+    if args.keys_file:
+        with open(args.keys_file) as f:
+            keys.extend(line.strip() for line in f if line.strip())
+
+    payload = {
+        "prefix": args.prefix,
+        "keys": keys or None,
+        "modified_within_hours": args.modified_within_hours,
+        "limit": args.limit,
+        "concurrency": args.concurrency,
+    }
+    with httpx.Client(base_url=args.url.rstrip("/"), timeout=30.0) as client:
+        response = client.post("/temp-files/warmup", json={k: v for k, v in payload.items() if v is not None})
+        if response.status_code >= 400:
+            print(f"Warm-up request failed: HTTP {response.status_code} {response.text}", file=sys.stderr)
+            return 1
+        job = response.json()
+        print(f"Started warm-up job {job['job_id']}")
+        if args.no_wait:
+            return 0
+
+        while job["status"] in ("pending", "listing", "running"):
+            time.sleep(args.poll_seconds)
+            job = client.get(f"/temp-files/warmup/{job['job_id']}").json()
+            print(
+                f"[{job['status']}] {job['completed']}/{job['total']} - {job['fetched']} fetched, "
+                f"{job['already_cached']} already cached, {job['failed']} failed, "
+                f"{job['bytes_fetched'] / 1024 ** 2:.1f} MiB in {job['elapsed_seconds']:.1f}s"
+            )
+
+    for error in job["errors"]:
+        print(f"  {error['s3_key']}: {error['error']}", file=sys.stderr)
+    if job["error"]:
+        print(f"Warm-up failed: {job['error']}", file=sys.stderr)
+    return 0 if job["status"] == "done" and not job["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())